@@ -0,0 +1,113 @@
+"""
+Compare the per-row cache loading loop against the binary COPY decoder.
+
+The per-row path is fed dicts standing in for asyncpg records, so the cost of
+asyncpg building those records isn't counted against it. The COPY path is fed
+the binary stream that Postgres would send for the same data.
+
+    python -m benchmarks.cache_load [guilds] [users per guild] [hours]
+"""
+
+from array import array
+from datetime import datetime as dt, timedelta
+import random
+import struct
+import sys
+import time
+
+from cogs.utils import bulk_load, cache_tools
+
+
+def make_rows(guilds: int, users: int, hours: int) -> list[dict]:
+    start = dt.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours)
+    rows = []
+    for guild_id in range(guilds):
+        for user_id in range(users):
+            for hour in range(hours):
+                if random.random() < 0.5:
+                    continue
+                rows.append({
+                    "guild_id": guild_id,
+                    "user_id": user_id,
+                    "bucket": start + timedelta(hours=hour),
+                    "source": "message",
+                    "points": float(random.randint(1, 60)),
+                })
+    return rows
+
+
+def make_copy_stream(rows: list[dict]) -> bytes:
+    """
+    Build the binary COPY output that build_series_query would give for the
+    given rows.
+    """
+
+    grouped: dict[tuple[int, int], list[dict]] = {}
+    for row in rows:
+        grouped.setdefault((row["guild_id"], row["user_id"]), []).append(row)
+
+    output = [bulk_load.COPY_SIGNATURE, struct.pack("!ii", 0, 0)]
+    source_count = len(cache_tools.PointSource)
+    for (guild_id, user_id), series_rows in grouped.items():
+        keys = array("i", (cache_tools._hour_key(i["bucket"]) for i in series_rows))
+        columns = [array("d") for _ in range(source_count)]
+        totals = [0.0] * source_count
+        for row in series_rows:
+            totals[cache_tools._SOURCE_INDEX[cache_tools.PointSource[row["source"]]]] += row["points"]
+            for total, column in zip(totals, columns):
+                column.append(total)
+        for i in (keys, *columns):
+            if sys.byteorder != "big":
+                i.byteswap()
+        output.append(struct.pack("!h", 2 + 1 + source_count))
+        output.append(struct.pack("!iq", 8, guild_id))
+        output.append(struct.pack("!iq", 8, user_id))
+        for i in (keys, *columns):
+            data = i.tobytes()
+            output.append(struct.pack("!i", len(data)))
+            output.append(data)
+    output.append(struct.pack("!h", -1))
+    return b"".join(output)
+
+
+def clear_cache():
+    cache_tools.PointHolder.hourly_points.clear()
+    cache_tools.PointHolder.window_days.clear()
+    cache_tools.PointHolder.window_start.clear()
+
+
+def main():
+    guilds, users, hours = (int(i) for i in (sys.argv[1:] or (20, 200, 24 * 90)))
+    rows = make_rows(guilds, users, hours)
+    stream = make_copy_stream(rows)
+    print(f"{len(rows):,} hourly buckets, {len(stream):,} byte COPY stream")
+
+    # Per-row loop, as in CacheHandler.load_tier
+    clear_cache()
+    started = time.perf_counter()
+    for row in rows:
+        cache_tools.PointHolder.set_bucket(
+            row["user_id"],
+            row["guild_id"],
+            row["bucket"],
+            cache_tools.PointSource[row["source"]],
+            row["points"],
+            bucket="hour",
+        )
+    row_elapsed = time.perf_counter() - started
+    print(f"Per-row loop: {len(rows) / row_elapsed:,.0f} rows/s")
+
+    # Binary COPY decode, as in CacheHandler.load_tier_bulk
+    clear_cache()
+    started = time.perf_counter()
+    decoder = bulk_load.SeriesCopyDecoder()
+    for offset in range(0, len(stream), 65_536):
+        for guild_id, user_id, series in decoder.feed(stream[offset:offset + 65_536]):
+            cache_tools.PointHolder.merge_series(user_id, guild_id, series, bucket="hour")
+    copy_elapsed = time.perf_counter() - started
+    print(f"Binary COPY: {len(rows) / copy_elapsed:,.0f} rows/s")
+    print(f"Speedup: {row_elapsed / copy_elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
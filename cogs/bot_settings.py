@@ -3,6 +3,8 @@ import uuid
 import discord
 from discord.ext import vbu
 
+from cogs import utils
+
 
 menus = vbu.menus
 
@@ -215,13 +217,17 @@ blacklisted_channel_settings = menus.Option(
             ctx.get_mentionable_channel(row['channel_id']).name,
             str(uuid.uuid4()),
         ),
-        cache_callback=menus.MenuCallbacks.set_iterable_list_cache(
-            menus.DataLocation.GUILD,
-            "blacklisted_channels",
+        cache_callback=utils.filters.GuildFilters.invalidating(
+            menus.MenuCallbacks.set_iterable_list_cache(
+                menus.DataLocation.GUILD,
+                "blacklisted_channels",
+            ),
         ),
-        cache_delete_callback=menus.MenuCallbacks.delete_iterable_list_cache(
-            menus.DataLocation.GUILD,
-            "blacklisted_channels",
+        cache_delete_callback=utils.filters.GuildFilters.invalidating(
+            menus.MenuCallbacks.delete_iterable_list_cache(
+                menus.DataLocation.GUILD,
+                "blacklisted_channels",
+            ),
         ),
         cache_delete_args=lambda row: (
             row['channel_id'],
@@ -268,13 +274,17 @@ blacklisted_role_messages = menus.Option(
             ctx.get_mentionable_role(row['role_id']).name,
             row['role_id'],
         ),
-        cache_callback=menus.MenuCallbacks.set_iterable_list_cache(
-            menus.DataLocation.GUILD,
-            "blacklisted_text_roles",
+        cache_callback=utils.filters.GuildFilters.invalidating(
+            menus.MenuCallbacks.set_iterable_list_cache(
+                menus.DataLocation.GUILD,
+                "blacklisted_text_roles",
+            ),
         ),
-        cache_delete_callback=menus.MenuCallbacks.delete_iterable_list_cache(
-            menus.DataLocation.GUILD,
-            "blacklisted_text_roles",
+        cache_delete_callback=utils.filters.GuildFilters.invalidating(
+            menus.MenuCallbacks.delete_iterable_list_cache(
+                menus.DataLocation.GUILD,
+                "blacklisted_text_roles",
+            ),
         ),
         cache_delete_args=lambda row: (
             row['role_id'],
@@ -321,13 +331,17 @@ blacklisted_role_voice = menus.Option(
             ctx.get_mentionable_role(row['role_id']).name,
             row['role_id'],
         ),
-        cache_callback=menus.MenuCallbacks.set_iterable_list_cache(
-            menus.DataLocation.GUILD,
-            "blacklisted_vc_roles",
+        cache_callback=utils.filters.GuildFilters.invalidating(
+            menus.MenuCallbacks.set_iterable_list_cache(
+                menus.DataLocation.GUILD,
+                "blacklisted_vc_roles",
+            ),
         ),
-        cache_delete_callback=menus.MenuCallbacks.delete_iterable_list_cache(
-            menus.DataLocation.GUILD,
-            "blacklisted_vc_roles",
+        cache_delete_callback=utils.filters.GuildFilters.invalidating(
+            menus.MenuCallbacks.delete_iterable_list_cache(
+                menus.DataLocation.GUILD,
+                "blacklisted_vc_roles",
+            ),
         ),
         cache_delete_args=lambda row: (
             row['role_id'],
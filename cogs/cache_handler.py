@@ -1,134 +1,830 @@
 import asyncio
-from datetime import datetime as dt
+import collections
+from datetime import datetime as dt, timedelta
+import functools
+import time
+from typing import Callable, Optional
 
-from discord.ext import vbu
+import discord
+from discord.ext import tasks, vbu
 
 from . import utils
 
 
+# {bucket: (table, bucket column, display name)}
+ROLLUP_TABLES = {
+    "hour": ("user_point_hourly_counts", "hour", "hourly"),
+    "day": ("user_point_daily_counts", "day", "daily"),
+    "month": ("user_point_monthly_counts", "month", "monthly"),
+}
+
+
+def tier_horizons() -> tuple[dt, dict[str, tuple[str, list]]]:
+    """
+    Get the start of the hourly data that's loaded on startup, and for each
+    tier the condition (with positional placeholders) and arguments that
+    limit what is read from its rollup table.
+
+    Hourly buckets are loaded for the last 90 whole days. Daily and monthly
+    buckets are only read from before that, as the rest are built from the
+    hourly buckets.
+    """
+
+    hourly_start = (
+        (dt.utcnow() - timedelta(days=90))
+        .replace(hour=0, minute=0, second=0, microsecond=0)
+    )
+    return hourly_start, {
+        "hour": (
+            "hour >= {0}",
+            [hourly_start],
+        ),
+        "day": (
+            "day < {0} AND day >= {1}",
+            [hourly_start.date(), (hourly_start - timedelta(days=630)).date()],
+        ),
+        "month": (
+            "month < {0}",
+            [hourly_start.date().replace(day=1)],
+        ),
+    }
+
+
 class CacheHandler(vbu.Cog[vbu.Bot]):
 
+    def __init__(self, bot: vbu.Bot):
+        super().__init__(bot)
+        self.warm_up_task: Optional[asyncio.Task] = None
+        utils.cache.PointHolder.window_member_check = self.is_guild_member
+        self.window_expiry_loop.start()
+        self.compaction_loop.start()
+
+        # Reconciliation state - the guilds left to check in this pass, and
+        # running drift counts
+        self.reconcile_queue: list[int] = []
+        self.drift_stats: collections.Counter[str] = collections.Counter()
+        reconcile_config = self.bot.config.get("cache_reconcile", {})
+        if reconcile_config.get("enabled"):
+            self.reconcile_loop.change_interval(
+                seconds=reconcile_config.get("interval_seconds", 60),
+            )
+            self.reconcile_loop.start()
+        snapshot_config = self.bot.config.get("cache_snapshot", {})
+        if snapshot_config.get("enabled"):
+            self.snapshot_loop.change_interval(
+                minutes=snapshot_config.get("interval_minutes", 15),
+            )
+            self.snapshot_loop.start()
+
+    def cog_unload(self):
+        utils.cache.PointHolder.window_member_check = None
+        self.window_expiry_loop.stop()
+        self.compaction_loop.stop()
+        self.snapshot_loop.stop()
+        self.reconcile_loop.stop()
+        if self.warm_up_task is not None:
+            self.warm_up_task.cancel()
+
+    @vbu.Cog.listener("on_member_remove")
+    async def window_member_remove(self, member: discord.Member):
+        """
+        Keep members that have left out of the guild's activity window.
+        """
+
+        utils.cache.PointHolder.remove_window_user(member.guild.id, member.id)
+
+    @vbu.Cog.listener("on_member_join")
+    async def window_member_join(self, member: discord.Member):
+        """
+        Put members that have rejoined back into the guild's activity window.
+        """
+
+        utils.cache.PointHolder.add_window_user(member.guild.id, member.id)
+
+    @tasks.loop(minutes=1)
+    async def window_expiry_loop(self):
+        """
+        Move each guild's activity window forward so that the running totals
+        drop buckets as they expire.
+        """
+
+        await utils.cache.PointHolder.expire_windows()
+
+    @tasks.loop(hours=1)
+    async def compaction_loop(self):
+        """
+        Drop cached points that are past their tier's retention.
+        """
+
+        retention = self.bot.config.get("cache_retention", {})
+        self.logger.info("Compacting cached points")
+        await utils.cache.PointHolder.compact(
+            raw_days=retention.get("raw_days", 31),
+            hourly_days=retention.get("hourly_days", 90),
+            daily_days=retention.get("daily_days", 730),
+            monthly_days=retention.get("monthly_days", 0),
+        )
+        self.logger.info("Compacted cached points")
+
+    @tasks.loop(minutes=15)
+    async def snapshot_loop(self):
+        """
+        Write the cached buckets to a local snapshot for fast restarts.
+        """
+
+        # Don't overwrite a good snapshot with a half-loaded cache
+        if self.bot.startup_method and not self.bot.startup_method.done():
+            return
+        if utils.cache.PointHolder.warming_up:
+            return
+        snapshot_config = self.bot.config["cache_snapshot"]
+        path = snapshot_config["path"]
+
+        # Points can be written to the database well after they're timestamped
+        # - they wait to be flushed, are retried, or are replayed from the
+        # journal - and anything not in the cache yet needs to be re-read after
+        # loading. This process's own points are covered by the oldest one it
+        # hasn't written, and the margin covers other processes (the website)
+        watermark = dt.utcnow() - timedelta(
+            minutes=snapshot_config.get("watermark_margin_minutes", 30),
+        )
+        oldest = utils.ingest.PointIngest.oldest_timestamp()
+        if oldest is not None:
+            watermark = min(watermark, oldest)
+        self.logger.info(f"Writing cache snapshot to {path}")
+        watermark = await utils.snapshot.write_snapshot(path, watermark)
+        self.logger.info(f"Wrote cache snapshot with watermark {watermark}")
+
+    @tasks.loop(seconds=60)
+    async def reconcile_loop(self):
+        """
+        Compare a slice of guilds' cached buckets against the rollup tables,
+        repairing any series that have drifted.
+        """
+
+        if self.bot.startup_method and not self.bot.startup_method.done():
+            return
+        if utils.cache.PointHolder.warming_up:
+            return
+
+        # Start a new pass over every guild once the last one is done
+        reconcile_config = self.bot.config.get("cache_reconcile", {})
+        if not self.reconcile_queue:
+            if self.drift_stats["guilds"]:
+                self.logger.info(
+                    "Finished cache reconciliation pass - "
+                    + ", ".join(f"{key}={value:,.0f}" for key, value in self.drift_stats.items())
+                )
+            self.drift_stats["passes"] += 1
+            self.reconcile_queue = sorted(
+                {i.id for i in self.bot.guilds}
+                | set(utils.cache.PointHolder.hourly_points),
+                reverse=True,
+            )
+        guild_ids = [
+            guild_id
+            for guild_id in (
+                self.reconcile_queue.pop()
+                for _ in range(min(
+                    reconcile_config.get("slice_guilds", 25),
+                    len(self.reconcile_queue),
+                ))
+            )
+            if self.is_own_guild(guild_id)
+            and utils.cache.PointHolder.is_guild_loaded(guild_id)
+        ]
+        if guild_ids:
+            await self.reconcile_guilds(guild_ids, reconcile_config.get("days", 30))
+
+    async def reconcile_guilds(self, guild_ids: list[int], days: int):
+        """
+        Compare the given guilds' cached buckets from the last given number of
+        days against the rollup tables, and replace any series that differ.
+        """
+
+        start = dt.utcnow() - timedelta(days=days)
+        async with self.bot.database() as db:
+            async with utils.cache.PointHolder.flush_lock:
+                for bucket, (table, column, name) in ROLLUP_TABLES.items():
+                    start_key = utils.cache._get_tier(bucket)[0](start)
+
+                    # Compare checksums
+                    rows = await db.call(
+                        utils.reconcile.build_checksum_query(bucket, table, column),
+                        guild_ids,
+                        start_key,
+                    )
+                    stored = {
+                        (row["guild_id"], row["user_id"]): utils.reconcile.Checksum(
+                            row["cells"],
+                            row["points"],
+                            row["weighted_points"],
+                        )
+                        for row in rows
+                    }
+                    cached = {
+                        (guild_id, user_id): utils.reconcile.series_checksum(series, start_key)
+                        for guild_id in guild_ids
+                        for user_id, series in (
+                            utils.cache.PointHolder._tier_storage(bucket)
+                            .get(guild_id, {})
+                            .items()
+                        )
+                    }
+                    drifted = [
+                        pair
+                        for pair in stored.keys() | cached.keys()
+                        if not stored.get(pair, utils.reconcile.EMPTY_CHECKSUM).matches(
+                            cached.get(pair, utils.reconcile.EMPTY_CHECKSUM)
+                        )
+                    ]
+                    self.drift_stats["series"] += len(stored.keys() | cached.keys())
+                    if not drifted:
+                        continue
+
+                    # And repair the series that differ
+                    rows = await db.call(
+                        utils.reconcile.build_cells_query(bucket, table, column),
+                        [guild_id for guild_id, _ in drifted],
+                        [user_id for _, user_id in drifted],
+                        start_key,
+                    )
+                    cells: dict[tuple[int, int], dict] = {pair: {} for pair in drifted}
+                    to_key, _ = utils.cache._get_tier(bucket)
+                    for row in rows:
+                        cells[(row["guild_id"], row["user_id"])][(
+                            to_key(row["bucket"]),
+                            utils.cache.PointSource[row["source"]],
+                        )] = row["points"]
+                    for (guild_id, user_id), user_cells in cells.items():
+                        utils.cache.PointHolder.repair_series(
+                            user_id,
+                            guild_id,
+                            start_key,
+                            user_cells,
+                            bucket=bucket,
+                        )
+                        self.drift_stats["point_drift"] += abs(
+                            stored.get((guild_id, user_id), utils.reconcile.EMPTY_CHECKSUM).points
+                            - cached.get((guild_id, user_id), utils.reconcile.EMPTY_CHECKSUM).points
+                        )
+                    self.drift_stats[f"{name}_repaired"] += len(drifted)
+                    self.logger.warning(
+                        f"Repaired {len(drifted):,} drifted {name} series "
+                        f"across {len(guild_ids):,} guilds"
+                    )
+        self.drift_stats["guilds"] += len(guild_ids)
+
     async def cache_setup(self, db: vbu.Database):
         """
         Load pre-aggregated point buckets into memory.
 
         Reads from rollup tables instead of rebuilding buckets from user_points.
+        If a snapshot is available then only the rows after its watermark are
+        read, otherwise the cache is warmed up in the background.
+        """
+
+        # See if we have a snapshot that we can start from
+        snapshot_config = self.bot.config.get("cache_snapshot", {})
+        loading_config = self.bot.config.get("cache_loading", {})
+        snapshot = None
+        if snapshot_config.get("enabled"):
+            self.logger.info("Loading cache snapshot")
+            snapshot = utils.snapshot.load_snapshot(
+                snapshot_config["path"],
+                guild_filter=self.is_own_guild,
+            )
+        if snapshot is not None:
+            watermark = snapshot.watermark
+            self.logger.info(
+                f"Loaded cache snapshot of {len(snapshot.guild_ids):,} guilds "
+                f"with watermark {watermark}"
+            )
+
+            # In lazy mode only the guilds in the snapshot are caught up -
+            # anything else is loaded in full when it's first used. They're
+            # marked before catching up so that new points for other guilds
+            # aren't added to what would be a partial series
+            lazy = loading_config.get("lazy", False)
+            guild_condition = "AND guild_id = ANY($2::BIGINT[])" if lazy else ""
+            guild_args = (list(snapshot.guild_ids),) if lazy else ()
+            if lazy:
+                utils.cache.PointHolder.loaded_guilds.update(snapshot.guild_ids)
+                utils.cache.PointHolder.guild_loader = self.load_guild
+            async with utils.cache.PointHolder.loading():
+                await self.load_tier(
+                    db,
+                    "hour",
+                    watermark.replace(minute=0, second=0, microsecond=0),
+                    *guild_args,
+                    where=f"hour >= $1 {guild_condition}",
+                )
+                await self.load_tier(
+                    db,
+                    "day",
+                    watermark.date(),
+                    *guild_args,
+                    where=f"day >= $1 {guild_condition}",
+                )
+                await self.load_tier(
+                    db,
+                    "month",
+                    watermark.date().replace(day=1),
+                    *guild_args,
+                    where=f"month >= $1 {guild_condition}",
+                )
+            self.logger.info("Added all bucketed points to cache")
+
+        # Otherwise warm up in the background so that commands can be used
+        # for each guild as soon as its points are loaded
+        else:
+            if self.warm_up_task is not None:
+                self.warm_up_task.cancel()
+            self.warm_up_task = asyncio.create_task(self.warm_up())
+        return True
+
+    async def get_guild_activity(self, db: vbu.Database, days: int) -> list[int]:
+        """
+        Get the IDs of the guilds on this process's shards that have had
+        points in the last given number of days, most active first.
         """
 
-        self.logger.info("Getting hourly point buckets from database")
-        hourly_rows = await db.call(
-            """
+        shard_condition, shard_args = self.shard_filter(2)
+        rows = await db.call(
+            f"""
             SELECT
-                guild_id,
-                user_id,
-                hour AS bucket,
-                source,
-                points
+                guild_id
             FROM
                 user_point_hourly_counts
-            WHERE hour >= NOW() - INTERVAL '90 days';
+            WHERE
+                hour >= NOW() - MAKE_INTERVAL(days => $1)
+                {f"AND {shard_condition}" if shard_condition else ""}
+            GROUP BY
+                guild_id
+            ORDER BY
+                SUM(points) DESC
             """,
+            days,
+            *shard_args,
         )
-        self.logger.info(f"Got {len(hourly_rows):,} hourly buckets from database")
+        return [i["guild_id"] for i in rows]
 
-        self.logger.info("Adding hourly buckets to cache")
-        for index, row in enumerate(hourly_rows):
-            if index % 10_000 == 0:
-                self.logger.info(
-                    f"Added {index:,}/{len(hourly_rows):,} "
-                    f"({index / len(hourly_rows) * 100:.2f}%) hourly buckets"
+    async def warm_up(self):
+        """
+        Load the rollup tables into the cache.
+
+        Recently active guilds are loaded first, most active first, in batches
+        of guilds; each batch can be used as soon as it's loaded. In lazy mode
+        that's all that's loaded, otherwise every other guild is then loaded
+        in one chunk per tier and guild ID range. Chunks are loaded
+        concurrently, each over its own pooled connection, and are retried if
+        they fail. If they keep failing then whatever wasn't loaded is loaded
+        on first use instead.
+        """
+
+        loading_config = self.bot.config.get("cache_loading", {})
+        lazy = loading_config.get("lazy", False)
+        retries = loading_config.get("warm_up_retries", 3)
+        semaphore = asyncio.Semaphore(loading_config.get("connections", 4))
+        hourly_start, horizons = tier_horizons()
+        started = time.perf_counter()
+        utils.cache.PointHolder.start_warm_up(())
+
+        async def retry(description: str, function, *args):
+            for attempt in range(retries + 1):
+                try:
+                    return await function(*args)
+                except Exception as e:
+                    if attempt == retries:
+                        raise
+                    delay = 2 ** attempt
+                    self.logger.warning(
+                        f"Failed to load {description}, retrying in {delay}s - {e}"
+                    )
+                    await asyncio.sleep(delay)
+
+        async def get_active_guild_ids():
+            async with self.bot.database() as db:
+                return await self.get_guild_activity(
+                    db,
+                    loading_config.get("active_days", 7),
                 )
-                await asyncio.sleep(0)
 
-            utils.cache.PointHolder.hourly_points[
-                row["guild_id"]
-            ][
-                row["user_id"]
-            ][
-                row["bucket"].replace(minute=0, second=0, microsecond=0)
-            ][
-                utils.cache.PointSource[row["source"]]
-            ] += row["points"]
-
-        self.logger.info("Getting daily point buckets from database")
-        daily_rows = await db.call(
-            """
-            SELECT
-                guild_id,
-                user_id,
-                day AS bucket,
-                source,
-                points
-            FROM
-                user_point_daily_counts
-            WHERE day >= CURRENT_DATE - INTERVAL '720 days';
-            """,
+        async def load_chunk(
+                bucket: str,
+                description: str,
+                on_loaded: Optional[Callable[[], None]],
+                condition: str,
+                *args):
+            _, _, name = ROLLUP_TABLES[bucket]
+            horizon, horizon_args = horizons[bucket]
+            chunk_args = [*horizon_args, *args]
+            conditions = [
+                horizon.format(*(
+                    f"${i + 1}"
+                    for i in range(len(horizon_args))
+                )),
+                condition.format(*(
+                    f"${len(horizon_args) + i + 1}"
+                    for i in range(len(args))
+                )),
+            ]
+
+            async def load():
+                started = time.perf_counter()
+                async with self.bot.database() as db:
+                    count = await self.load_tier(
+                        db,
+                        bucket,
+                        *chunk_args,
+                        where=" AND ".join(conditions),
+                    )
+                return count, time.perf_counter() - started
+
+            async def load_hourly():
+                # Hourly buckets are loaded with flushes held off, and the
+                # guilds start taking new points as soon as they're in, so
+                # every point is counted once
+                async with utils.cache.PointHolder.loading():
+                    loaded = await load()
+                    if on_loaded is not None:
+                        on_loaded()
+                return loaded
+
+            async with semaphore:
+                count, elapsed = await retry(
+                    f"{name} buckets for {description}",
+                    load_hourly if bucket == "hour" else load,
+                )
+            self.logger.info(
+                f"Loaded {count:,} {name} buckets for {description} "
+                f"in {elapsed:.2f}s ({count / max(elapsed, 1e-6):,.0f} rows/s)"
+            )
+
+        async def derive_tiers(guild_ids: list[int]):
+            # Each guild is marked as loaded straight after its tiers are
+            # built, so that none of its points only go to the hourly tier
+            for index, guild_id in enumerate(guild_ids):
+                if index % 100 == 0:
+                    await asyncio.sleep(0)
+                utils.cache.PointHolder.derive_tiers(guild_id, hourly_start)
+                utils.cache.PointHolder.mark_tiers_loaded([guild_id], *ROLLUP_TABLES)
+
+        async def load_batch(index: int, guild_ids: list[int], batch_count: int):
+            description = f"active guild batch {index + 1}/{batch_count}"
+            await asyncio.gather(*(
+                load_chunk(
+                    bucket,
+                    description,
+                    lambda: utils.cache.PointHolder.mark_tiers_loaded(guild_ids, "hour"),
+                    "guild_id = ANY({0}::BIGINT[])",
+                    guild_ids,
+                )
+                for bucket in ROLLUP_TABLES
+            ))
+            await derive_tiers(guild_ids)
+
+        # And then everyone else, split into equal guild ID ranges across the
+        # snowflake space up to now
+        async def load_inactive(active_guild_ids: list[int]):
+            if lazy:
+                return
+            range_count = loading_config.get("guild_ranges", 8)
+            newest_id = discord.utils.time_snowflake(discord.utils.utcnow(), high=True)
+            step = newest_id // range_count + 1
+            ranges = [
+                (index * step, (index + 1) * step)
+                for index in range(range_count)
+            ]
+            ranges[-1] = (ranges[-1][0], 2 ** 63 - 1)
+            await asyncio.gather(*(
+                load_chunk(
+                    bucket,
+                    f"guild range {index + 1}/{len(ranges)}",
+                    functools.partial(
+                        utils.cache.PointHolder.mark_range_loaded,
+                        lower,
+                        upper,
+                        "hour",
+                    ),
+                    (
+                        "guild_id >= {0} AND guild_id < {1} "
+                        "AND NOT guild_id = ANY({2}::BIGINT[])"
+                    ),
+                    lower,
+                    upper,
+                    active_guild_ids,
+                )
+                for bucket in ROLLUP_TABLES
+                for index, (lower, upper) in enumerate(ranges)
+            ))
+
+            def underived() -> list[int]:
+                return [
+                    guild_id
+                    for guild_id in (
+                        set(utils.cache.PointHolder.hourly_points)
+                        | set(utils.cache.PointHolder.daily_points)
+                    )
+                    if guild_id not in utils.cache.PointHolder.warm_tiers
+                ]
+
+            # Guilds that got their first points while the others were being
+            # built are caught up at the end, along with marking every range
+            # as loaded, without giving up the event loop in between
+            await derive_tiers(underived())
+            for guild_id in underived():
+                utils.cache.PointHolder.derive_tiers(guild_id, hourly_start)
+                utils.cache.PointHolder.mark_tiers_loaded([guild_id], *ROLLUP_TABLES)
+            for lower, upper in ranges:
+                utils.cache.PointHolder.mark_range_loaded(lower, upper, *ROLLUP_TABLES)
+
+        try:
+            # Work out which guilds to load first
+            active_guild_ids = await retry("active guilds", get_active_guild_ids)
+            utils.cache.PointHolder.start_warm_up(active_guild_ids)
+            if lazy:
+                utils.cache.PointHolder.loaded_guilds.update(active_guild_ids)
+                utils.cache.PointHolder.guild_loader = self.load_guild
+            self.logger.info(
+                f"Warming up cache for {len(active_guild_ids):,} active guilds"
+            )
+
+            # Load the active guilds in batches - the semaphore is first come
+            # first served, so the batches are loaded in order
+            batch_size = loading_config.get("warm_up_batch_guilds", 100)
+            batches = [
+                active_guild_ids[index:index + batch_size]
+                for index in range(0, len(active_guild_ids), batch_size)
+            ]
+            results = await asyncio.gather(
+                *(
+                    load_batch(index, guild_ids, len(batches))
+                    for index, guild_ids in enumerate(batches)
+                ),
+                load_inactive(active_guild_ids),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+        except Exception:
+            self.logger.exception(
+                "Failed to warm up cache, loading the remaining guilds on first use"
+            )
+            self.fall_back_to_lazy()
+        utils.cache.PointHolder.finish_warm_up()
+        self.logger.info(
+            f"Warmed up cache in {time.perf_counter() - started:.2f}s"
+        )
+
+    def fall_back_to_lazy(self):
+        """
+        Switch to loading guilds on first use after a failed warm-up, keeping
+        the guilds that were fully loaded.
+        """
+
+        holder = utils.cache.PointHolder
+        if holder.guild_loader is not None:
+            holder.loaded_guilds.difference_update([
+                guild_id
+                for guild_id in holder.warm_tiers
+                if not holder.is_guild_ready(guild_id)
+            ])
+            return
+        known_guild_ids = (
+            set(holder.warm_tiers)
+            | {i.id for i in self.bot.guilds}
+            | set(holder.hourly_points)
+            | set(holder.daily_points)
+            | set(holder.monthly_points)
+        )
+        holder.loaded_guilds.update(
+            guild_id
+            for guild_id in known_guild_ids
+            if holder.is_guild_ready(guild_id)
         )
-        self.logger.info(f"Got {len(daily_rows):,} daily buckets from database")
+        holder.guild_loader = self.load_guild
 
-        self.logger.info("Adding daily buckets to cache")
-        for index, row in enumerate(daily_rows):
+    async def load_guild(self, guild_id: int):
+        """
+        Load all of a single guild's buckets into the cache in one query.
+        """
+
+        self.logger.info(f"Loading point buckets for guild {guild_id}")
+        hourly_start, horizons = tier_horizons()
+        async with self.bot.database() as db:
+            rows = await db.call(
+                f"""
+                SELECT
+                    'hour' AS tier,
+                    user_id,
+                    hour AS bucket,
+                    source,
+                    points
+                FROM
+                    user_point_hourly_counts
+                WHERE
+                    guild_id = $1
+                AND
+                    {horizons["hour"][0].format("$2")}
+                UNION ALL
+                SELECT
+                    'day' AS tier,
+                    user_id,
+                    day::TIMESTAMP AS bucket,
+                    source,
+                    points
+                FROM
+                    user_point_daily_counts
+                WHERE
+                    guild_id = $1
+                AND
+                    {horizons["day"][0].format("$3", "$4")}
+                UNION ALL
+                SELECT
+                    'month' AS tier,
+                    user_id,
+                    month::TIMESTAMP AS bucket,
+                    source,
+                    points
+                FROM
+                    user_point_monthly_counts
+                WHERE
+                    guild_id = $1
+                AND
+                    {horizons["month"][0].format("$5")}
+                ORDER BY
+                    tier,
+                    user_id,
+                    bucket
+                """,
+                guild_id,
+                *horizons["hour"][1],
+                *horizons["day"][1],
+                *horizons["month"][1],
+            )
+        for index, row in enumerate(rows):
             if index % 10_000 == 0:
-                self.logger.info(
-                    f"Added {index:,}/{len(daily_rows):,} "
-                    f"({index / len(daily_rows) * 100:.2f}%) daily buckets"
-                )
                 await asyncio.sleep(0)
-
-            bucket = row["bucket"]
-            if not isinstance(bucket, dt):
-                bucket = dt.combine(bucket, dt.min.time())
-
-            utils.cache.PointHolder.daily_points[
-                row["guild_id"]
-            ][
-                row["user_id"]
-            ][
-                bucket.replace(hour=0, minute=0, second=0, microsecond=0)
-            ][
-                utils.cache.PointSource[row["source"]]
-            ] += row["points"]
-
-        self.logger.info("Getting monthly point buckets from database")
-        monthly_rows = await db.call(
-            """
-            SELECT
+            utils.cache.PointHolder.set_bucket(
+                row["user_id"],
                 guild_id,
-                user_id,
-                month AS bucket,
-                source,
-                points
-            FROM
-                user_point_monthly_counts
-            """,
+                row["bucket"],
+                utils.cache.PointSource[row["source"]],
+                row["points"],
+                bucket=row["tier"],
+            )
+        utils.cache.PointHolder.derive_tiers(guild_id, hourly_start)
+        self.logger.info(f"Loaded {len(rows):,} point buckets for guild {guild_id}")
+
+    def is_guild_member(self, guild_id: int, user_id: int) -> bool:
+        """
+        Whether or not a user is still in a guild. Guilds that aren't cached
+        are assumed to still have everyone.
+        """
+
+        guild = self.bot.get_guild(guild_id)
+        return guild is None or guild.get_member(user_id) is not None
+
+    def is_own_guild(self, guild_id: int) -> bool:
+        """
+        Whether or not a guild belongs to one of this process's shards.
+        """
+
+        if not self.bot.shard_ids:
+            return True
+        return (guild_id >> 22) % self.bot.shard_count in self.bot.shard_ids
+
+    def shard_filter(self, first_arg: int) -> tuple[Optional[str], list]:
+        """
+        Get an SQL condition (and its arguments) that limits a query's
+        guild_id to this process's shards, numbering its parameters from the
+        given index.
+        """
+
+        if not self.bot.shard_ids:
+            return None, []
+        return (
+            f"(guild_id >> 22) % ${first_arg} = ANY(${first_arg + 1}::BIGINT[])",
+            [self.bot.shard_count, list(self.bot.shard_ids)],
         )
-        self.logger.info(f"Got {len(monthly_rows):,} monthly buckets from database")
 
-        self.logger.info("Adding monthly buckets to cache")
-        for index, row in enumerate(monthly_rows):
-            if index % 10_000 == 0:
-                self.logger.info(
-                    f"Added {index:,}/{len(monthly_rows):,} "
-                    f"({index / len(monthly_rows) * 100:.2f}%) monthly buckets"
-                )
+    async def load_tier(
+            self,
+            db: vbu.Database,
+            bucket: str,
+            *args,
+            where: Optional[str] = None) -> int:
+        """
+        Load rows from one of the rollup tables into the cache, limited to
+        this process's shards. Returns the number of rows loaded.
+
+        Loaded buckets overwrite whatever is cached for them rather than being
+        added to it, so loading the same rows twice is harmless.
+        """
+
+        table, column, name = ROLLUP_TABLES[bucket]
+        shard_condition, shard_args = self.shard_filter(len(args) + 1)
+        conditions = [i for i in (where, shard_condition) if i]
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        loading_config = self.bot.config.get("cache_loading", {})
+        if loading_config.get("bulk_copy"):
+            return await self.load_tier_bulk(
+                db,
+                bucket,
+                where_clause,
+                *args,
+                *shard_args,
+            )
+        batch_size = loading_config.get("batch_size", 10_000)
+
+        # Stream the rows through a server-side cursor so that only one batch
+        # is held in memory at a time. They're read in the primary key's order
+        # so that each bucket lands at the end of its series, rather than
+        # shifting every running total after it
+        self.logger.info(f"Streaming {name} point buckets from database")
+        added = 0
+        async with db.conn.transaction():
+            cursor = await db.conn.cursor(
+                f"""
+                SELECT
+                    guild_id,
+                    user_id,
+                    {column} AS bucket,
+                    source,
+                    points
+                FROM
+                    {table}
+                {where_clause}
+                ORDER BY
+                    guild_id,
+                    user_id,
+                    {column}
+                """,
+                *args,
+                *shard_args,
+            )
+            while rows := await cursor.fetch(batch_size):
+                for row in rows:
+                    utils.cache.PointHolder.set_bucket(
+                        row["user_id"],
+                        row["guild_id"],
+                        row["bucket"],
+                        utils.cache.PointSource[row["source"]],
+                        row["points"],
+                        bucket=bucket,
+                    )
+                added += len(rows)
+                del rows
+                self.logger.debug(f"Added {added:,} {name} buckets to cache")
                 await asyncio.sleep(0)
+        self.logger.info(f"Added {added:,} {name} buckets to cache")
+        return added
 
-            bucket = row["bucket"]
-            if not isinstance(bucket, dt):
-                bucket = dt.combine(bucket, dt.min.time())
-
-            utils.cache.PointHolder.monthly_points[
-                row["guild_id"]
-            ][
-                row["user_id"]
-            ][
-                bucket.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            ][
-                utils.cache.PointSource[row["source"]]
-            ] += row["points"]
-
-        self.logger.info("Added all bucketed points to cache")
-        return True
+    async def load_tier_bulk(
+            self,
+            db: vbu.Database,
+            bucket: str,
+            where_clause: str,
+            *args) -> int:
+        """
+        Load one of the rollup tables into the cache through a binary COPY,
+        decoding each (guild, user) series directly into its arrays. Returns
+        the number of buckets loaded.
+        """
+
+        table, column, name = ROLLUP_TABLES[bucket]
+        query = utils.bulk_load.build_series_query(
+            bucket,
+            table,
+            column,
+            where_clause,
+        )
+        decoder = utils.bulk_load.SeriesCopyDecoder()
+        added = 0
+
+        async def output(data: bytes):
+            nonlocal added
+            for guild_id, user_id, series in decoder.feed(data):
+                utils.cache.PointHolder.merge_series(
+                    user_id,
+                    guild_id,
+                    series,
+                    bucket=bucket,
+                )
+                added += len(series)
+
+        self.logger.info(f"Copying {name} point buckets from database")
+        await db.conn.copy_from_query(
+            query,
+            *args,
+            output=output,
+            format="binary",
+        )
+        self.logger.info(f"Added {added:,} {name} buckets to cache")
+        return added
 
 
 def setup(bot: vbu.Bot):
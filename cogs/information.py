@@ -1,7 +1,6 @@
 from datetime import datetime as dt, timedelta
 import math
 from typing import Optional
-import collections
 import random
 
 import discord
@@ -39,6 +38,7 @@ class Information(vbu.Cog[utils.types.Bot]):
     @commands.cooldown(1, 60, commands.BucketType.user)
     @commands.guild_only()
     @vbu.checks.bot_is_ready()
+    @utils.checks.guild_cache_is_ready()
     async def graph(
             self,
             ctx: vbu.Context,
@@ -50,6 +50,7 @@ class Information(vbu.Cog[utils.types.Bot]):
 
         user = user or ctx.author  # type: ignore
         assert user
+        await utils.cache.PointHolder.ensure_guild(ctx.guild.id)
         window_days = window_days or self.bot.guild_settings[ctx.guild.id]['activity_window_days']
         assert window_days
         return await self.make_graph(ctx, [user.id], window_days, colours={user.id: "000000"})
@@ -72,6 +73,7 @@ class Information(vbu.Cog[utils.types.Bot]):
     @commands.bot_has_permissions(send_messages=True, embed_links=True)
     @commands.guild_only()
     @vbu.checks.bot_is_ready()
+    @utils.checks.guild_cache_is_ready()
     async def leaderboard(self, ctx: vbu.Context, days: Optional[int] = None):
         """
         Gives you the leaderboard users for the server.
@@ -89,6 +91,12 @@ class Information(vbu.Cog[utils.types.Bot]):
 
         # Type hint properly
         assert ctx.guild
+        await utils.cache.PointHolder.ensure_guild(ctx.guild.id)
+
+        # The guild's own activity window has a live index that we can page
+        # through without totalling everyone
+        if days == self.bot.guild_settings[ctx.guild.id]['activity_window_days']:
+            return await self.window_leaderboard(ctx, days)
 
         # This takes a while
         async with ctx.typing():
@@ -103,6 +111,7 @@ class Information(vbu.Cog[utils.types.Bot]):
                 {
                     "id": uid,
                     "points": d,
+                    "total": utils.cache.PointHolder.total_points(d),
                 }
                 for uid, d in user_points.items()
                 if ctx.guild.get_member(uid)
@@ -111,23 +120,15 @@ class Information(vbu.Cog[utils.types.Bot]):
             # Sort said list
             ordered_guild_user_data = sorted(
                 valid_guild_user_data,
-                key=lambda d: utils.cache.PointHolder.total_points(d["points"]),
+                key=lambda d: d["total"],
                 reverse=True,
             )
 
             # And now make it into strings
-            ordered_guild_user_strings = []
-            for d in ordered_guild_user_data:
-                total_points = utils.cache.PointHolder.total_points(d["points"])
-                vc_time = vbu.TimeValue(d["points"].get(utils.cache.PointSource.voice, 0) * 60).clean_spaced or '0m'
-                text = (
-                    "**<@{id}>** - **{total_points:,}** "
-                    "(**{message:,}** text, **{voice}** VC)"
-                )
-                ordered_guild_user_strings.append(text.format(
-                    id=d["id"], message=int(d["points"].get(utils.cache.PointSource.message, 0)),
-                    total_points=total_points, voice=vc_time,
-                ))
+            ordered_guild_user_strings = [
+                self.leaderboard_line(d["id"], d["points"])
+                for d in ordered_guild_user_data
+            ]
 
         # Make menu
         return await vbu.Paginator(
@@ -135,6 +136,64 @@ class Information(vbu.Cog[utils.types.Bot]):
             formatter=vbu.Paginator.default_ranked_list_formatter,
         ).start(ctx)
 
+    async def window_leaderboard(self, ctx: vbu.Context, days: int):
+        """
+        Show a leaderboard over the guild's activity window, fetching each page
+        from the live index as it's viewed. Members that have left are kept
+        out of the index, so pages are full and ranks don't skip anyone.
+        """
+
+        assert ctx.guild
+        guild = ctx.guild
+        per_page = 10
+
+        def get_page(paginator: vbu.Paginator, page_number: int) -> list[str]:
+            rows = utils.cache.PointHolder.get_window_leaderboard(
+                guild.id,
+                days,
+                start=page_number * per_page,
+                stop=(page_number + 1) * per_page,
+            )
+            after = dt.utcnow() - timedelta(days=days)
+            return [
+                self.leaderboard_line(
+                    user_id,
+                    utils.cache.PointHolder.get_source_totals_between(
+                        user_id,
+                        guild.id,
+                        after=after,
+                    ),
+                )
+                for user_id, _ in rows
+            ]
+
+        user_count = utils.cache.PointHolder.get_window_user_count(guild.id, days)
+        return await vbu.Paginator(
+            get_page,
+            per_page=per_page,
+            formatter=vbu.Paginator.default_ranked_list_formatter,
+            max_pages=max(math.ceil(user_count / per_page), 1),
+        ).start(ctx)
+
+    @staticmethod
+    def leaderboard_line(
+            user_id: int,
+            points: dict[utils.cache.PointSource, float]) -> str:
+        """
+        Format a single user's leaderboard entry.
+        """
+
+        total_points = utils.cache.PointHolder.total_points(points)
+        vc_time = vbu.TimeValue(points.get(utils.cache.PointSource.voice, 0) * 60).clean_spaced or '0m'
+        text = (
+            "**<@{id}>** - **{total_points:,}** "
+            "(**{message:,}** text, **{voice}** VC)"
+        )
+        return text.format(
+            id=user_id, message=int(points.get(utils.cache.PointSource.message, 0)),
+            total_points=total_points, voice=vc_time,
+        )
+
     @commands.command(
         application_command_meta=commands.ApplicationCommandMeta(
             options=[
@@ -158,6 +217,7 @@ class Information(vbu.Cog[utils.types.Bot]):
     @commands.bot_has_permissions(send_messages=True)
     @commands.guild_only()
     @vbu.checks.bot_is_ready()
+    @utils.checks.guild_cache_is_ready()
     async def points(
             self,
             ctx: vbu.Context,
@@ -174,11 +234,10 @@ class Information(vbu.Cog[utils.types.Bot]):
 
         assert isinstance(days, int)
         assert user
+        await utils.cache.PointHolder.ensure_guild(ctx.guild.id)
 
         after = dt.utcnow() - timedelta(days=days)
 
-        user_points: dict[utils.cache.PointSource, float] = collections.defaultdict(float)
-
         # Use daily buckets for longer ranges, hourly buckets for short ranges.
         bucket_type = "day"
         if days <= 15:
@@ -186,19 +245,13 @@ class Information(vbu.Cog[utils.types.Bot]):
         elif days > 365:
             bucket_type = "month"
 
-        bucketed_points = utils.cache.PointHolder.get_bucketed_points(
+        user_points = utils.cache.PointHolder.get_source_totals_between(
             user.id,
             ctx.guild.id,
+            after=after,
             bucket=bucket_type,
         )
 
-        for bucket_timestamp, source_counter in bucketed_points.items():
-            if bucket_timestamp < after:
-                continue
-
-            for source, points in source_counter.items():
-                user_points[source] += points
-
         # If these should be displayed as whole numbers
         user_points = {
             source: int(points)
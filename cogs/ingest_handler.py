@@ -0,0 +1,80 @@
+import asyncio
+from typing import Optional
+
+from discord.ext import vbu
+
+from . import utils
+
+
+class IngestHandler(vbu.Cog[vbu.Bot]):
+
+    def __init__(self, bot: vbu.Bot):
+        super().__init__(bot)
+        self.start_task: Optional[asyncio.Task] = None
+
+        # Write whatever is pending before the bot closes its database pool
+        self.bot_close = self.bot.close
+        self.bot.close = self.close_bot  # type: ignore
+
+        # If the last instance of the cog is still stopping then wait for it
+        stopping = utils.ingest.PointIngest.stopping
+        if stopping is not None and not stopping.done():
+            self.start_task = asyncio.create_task(self.start_after(stopping))
+        else:
+            self.start_ingest()
+
+    async def start_after(self, stopping: asyncio.Task):
+        """
+        Start the ingest pipeline once the given stop has finished.
+        """
+
+        await asyncio.wait([stopping])
+        self.start_ingest()
+
+    async def close_bot(self, *args, **kwargs):
+        """
+        Stop the ingest pipeline, writing whatever points are still pending,
+        and then close the bot as normal.
+        """
+
+        try:
+            await utils.ingest.PointIngest.stop()
+        except Exception as e:
+            self.logger.error("Failed to write pending points on shutdown", exc_info=e)
+        await self.bot_close(*args, **kwargs)
+
+    def start_ingest(self):
+        ingest_config = self.bot.config.get("point_ingest", {})
+        utils.ingest.PointIngest.start(
+            self.bot.database,
+            flush_interval=ingest_config.get("flush_interval_seconds", 60),
+            flush_size=ingest_config.get("flush_size", 10_000),
+            batch_size=ingest_config.get("batch_size", 10_000),
+            max_pending=ingest_config.get("max_pending", 1_000_000),
+            max_retry_delay=ingest_config.get("max_retry_seconds", 60),
+            breaker_failures=ingest_config.get("breaker_failures", 5),
+            breaker_cooldown=ingest_config.get("breaker_cooldown_seconds", 300),
+            staging_copy=ingest_config.get("staging_copy", False),
+            voice_sessions=self.bot.config.get("voice_sessions", {}).get("enabled", False),
+            journal_path=(
+                ingest_config.get("journal_path", "cache/journal")
+                if ingest_config.get("journal_enabled")
+                else None
+            ),
+            logger=self.logger,
+        )
+
+    def cog_unload(self):
+        """
+        Stop the ingest pipeline, writing whatever points are still pending.
+        """
+
+        self.bot.close = self.bot_close  # type: ignore
+        if self.start_task is not None:
+            self.start_task.cancel()
+        utils.ingest.PointIngest.stopping = asyncio.create_task(utils.ingest.PointIngest.stop())
+
+
+def setup(bot: vbu.Bot):
+    x = IngestHandler(bot)
+    bot.add_cog(x)
@@ -81,6 +81,9 @@ class RoleHandler(vbu.Cog[utils.types.Bot]):
                 .append(role_id)
             )
 
+        # The blacklists have been reloaded, so rebuild their filters
+        utils.filters.GuildFilters.invalidate()
+
         # And done
         return True
 
@@ -141,6 +144,10 @@ class RoleHandler(vbu.Cog[utils.types.Bot]):
         if self.bot.startup_method and not self.bot.startup_method.done():
             return
 
+        # And that the guild's points are in the cache
+        if not utils.cache.PointHolder.is_guild_ready(user.guild.id, "hour"):
+            return
+
         # Don't add roles to bots
         if user.bot:
             return
@@ -186,10 +193,11 @@ class RoleHandler(vbu.Cog[utils.types.Bot]):
         )
 
         # Get the user's points
-        points_in_week = utils.cache.PointHolder.get_point_total_above_age(
+        await utils.cache.PointHolder.ensure_guild(user.guild.id)
+        points_in_week = utils.cache.PointHolder.get_window_total(
             user.id,
             user.guild.id,
-            days=self.bot.guild_settings[user.guild.id]['activity_window_days'],
+            self.bot.guild_settings[user.guild.id]['activity_window_days'],
         )
 
         # Run for each role
@@ -1,6 +1,7 @@
+import asyncio
+from datetime import datetime as dt, timedelta
+import time
 import typing
-from datetime import datetime as dt
-import collections
 
 import discord
 from discord.ext import tasks, vbu
@@ -12,10 +13,45 @@ class UserVCHandler(vbu.Cog):
 
     def __init__(self, bot: vbu.Bot):
         super().__init__(bot)
+        self.voice_tracker = utils.voice.VoiceTracker()
+        for guild in self.bot.guilds:
+            self.sync_voice_tracker(guild)
+
+        # Voice minutes are stored as sessions rather than one row per minute
+        session_config = self.bot.config.get("voice_sessions", {})
+        self.voice_sessions: typing.Optional[utils.voice.VoiceSessionLog] = None
+        if session_config.get("enabled", False):
+            self.voice_sessions = utils.voice.VoiceSessionLog()
+        self.session_checkpoint = timedelta(minutes=session_config.get("checkpoint_minutes", 15))
+        self.last_session_checkpoint = dt.utcnow()
+        self.closed_sessions: typing.List[utils.voice.VoiceSession] = []
+
+        # Members that aren't in the gateway cache are looked up in batches
+        lookup_config = self.bot.config.get("voice_member_lookup", {})
+        self.member_cache: utils.members.MemberCache[discord.Member] = utils.members.MemberCache(
+            ttl=lookup_config.get("cache_seconds", 300),
+            negative_ttl=lookup_config.get("missing_cache_seconds", 300),
+        )
+        self.member_query_semaphore = asyncio.Semaphore(lookup_config.get("concurrency", 4))
+        self.member_query_timeout = lookup_config.get("timeout_seconds", 10)
+
+        # The scan is spread across the minute in slices of guilds
+        scan_config = self.bot.config.get("voice_scan", {})
+        self.scan_pacer = utils.voice.ScanPacer(
+            spread=scan_config.get("spread_seconds", 50),
+            slice_size=scan_config.get("slice_guilds", 50),
+            min_slice_size=scan_config.get("min_slice_guilds", 5),
+            max_slice_size=scan_config.get("max_slice_guilds", 500),
+            target_lag=scan_config.get("target_lag_ms", 50) / 1_000,
+        )
+
         self.user_vc_databaser.start()
 
     def cog_unload(self):
         self.user_vc_databaser.stop()
+        if self.voice_sessions is not None:
+            self.closed_sessions.extend(self.voice_sessions.close_all())
+            asyncio.create_task(self.save_voice_sessions())
 
     @staticmethod
     def valid_voice_state(voice_state: discord.VoiceState) -> bool:
@@ -31,185 +67,248 @@ class UserVCHandler(vbu.Cog):
             voice_state.afk,
         ])
 
-    @tasks.loop(minutes=1)
-    async def user_vc_databaser(self):
+    def track_voice_state(
+            self,
+            guild_id: int,
+            user_id: int,
+            voice_state: typing.Optional[discord.VoiceState]) -> None:
         """
-        Saves all VC points into the database.
+        Update the voice tracker with a user's current voice state. This only
+        needs their ID, so users that aren't in the member cache are tracked
+        too, and looked up when their points are handed out.
         """
 
-        voice_channels: typing.List[discord.VoiceChannel] = []
-        for i in self.bot.guilds:
-            voice_channels.extend(i.voice_channels)
+        user = self.bot.get_user(user_id)
+        if user is not None and user.bot:
+            return
+        channel = voice_state.channel if voice_state else None
+        if not isinstance(channel, discord.VoiceChannel):
+            channel = None
+        self.voice_tracker.set_state(
+            guild_id,
+            user_id,
+            channel.id if channel else None,
+            voice_state is not None and self.valid_voice_state(voice_state),
+        )
+
+    def sync_voice_tracker(self, guild: discord.Guild) -> None:
+        """
+        Replace what the voice tracker has for a guild with everyone that's
+        in its voice channels right now.
+        """
 
-        voice_members: typing.List[typing.Tuple[int, int, int]] = []
+        self.voice_tracker.remove_guild(guild.id)
+        for vc in guild.voice_channels:
+            for user_id, state in vc.voice_states.items():
+                self.track_voice_state(guild.id, user_id, state)
+
+    @vbu.Cog.listener("on_guild_available")
+    async def voice_tracker_guild_sync(self, guild: discord.Guild):
+        self.sync_voice_tracker(guild)
+
+    @vbu.Cog.listener("on_guild_unavailable")
+    @vbu.Cog.listener("on_guild_remove")
+    async def voice_tracker_guild_remove(self, guild: discord.Guild):
+        self.voice_tracker.remove_guild(guild.id)
+
+    @vbu.Cog.listener("on_guild_channel_delete")
+    async def voice_tracker_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.voice_tracker.remove_channel(channel.id)
+
+    @vbu.Cog.listener("on_voice_state_update")
+    async def voice_tracker_update(
+            self,
+            member: discord.Member,
+            before: discord.VoiceState,
+            after: discord.VoiceState):
+        """
+        Keep the voice tracker up to date as members join, leave, move, and
+        mute or unmute.
+        """
 
-        for vc in voice_channels:
-            try:
-                _ = vc.id
-                _ = vc.guild.id
-            except AttributeError:
-                continue
+        if member.bot:
+            return
+        self.track_voice_state(member.guild.id, member.id, after if after.channel else None)
+
+    async def query_member_chunk(self, guild: discord.Guild, user_ids: typing.List[int]) -> None:
+        """
+        Look up a chunk of members in a guild over the gateway, caching
+        both who was found and who wasn't.
+        """
 
+        async with self.member_query_semaphore:
             try:
-                non_bot_users = [
-                    (user_id, state)
-                    for user_id, state in vc.voice_states.items()
-                    if (
-                        self.bot.get_user(user_id)
-                        and self.bot.get_user(user_id).bot is False
-                    )
-                ]
-            except Exception:
-                non_bot_users = []
-
-            if len(non_bot_users) > 1:
-                voice_members.extend([
-                    (user_id, vc.guild.id, vc.id)
-                    for user_id, state in non_bot_users
-                    if self.valid_voice_state(state)
-                ])
-
-        for user_id, guild_id, channel_id in voice_members.copy():
-            blacklisted_roles: typing.List[int] = (
-                self.bot.guild_settings[guild_id]
-                .setdefault('blacklisted_vc_roles', list())
-            )
+                members = await asyncio.wait_for(
+                    guild.query_members(user_ids=user_ids, limit=len(user_ids), cache=True),
+                    timeout=self.member_query_timeout,
+                )
+            except Exception as e:
+                self.logger.warning(f"Failed to look up {len(user_ids)} members in guild {guild.id} - {e}")
+                return
+        now = time.monotonic()
+        for member in members:
+            self.member_cache.add_found(guild.id, member.id, member, now)
+        self.member_cache.add_missing(guild.id, set(user_ids).difference(i.id for i in members), now)
+
+    async def resolve_members(self, unresolved: typing.Dict[discord.Guild, typing.Set[int]]) -> None:
+        """
+        Look up members that aren't in the gateway cache, in chunks of 100
+        per guild, a few chunks at a time.
+        """
 
-            guild = self.bot.get_guild(guild_id)
+        chunks = []
+        for guild, user_ids in unresolved.items():
+            ordered = sorted(user_ids)
+            for start in range(0, len(ordered), 100):
+                chunks.append(self.query_member_chunk(guild, ordered[start:start + 100]))
+        self.logger.info(f"Looking up {sum(len(i) for i in unresolved.values())} uncached VC members")
+        await asyncio.gather(*chunks)
 
-            try:
-                member = guild.get_member(user_id) or await guild.fetch_member(user_id)
-                assert member is not None
-            except (AssertionError, discord.HTTPException):
-                voice_members.remove((user_id, guild_id, channel_id))
-                continue
+    async def save_voice_sessions(self, include_open: bool = False) -> None:
+        """
+        Write the closed voice sessions, and optionally any open sessions that
+        have changed since they were last written. Closed sessions that fail
+        to save are kept to be tried again.
+        """
 
-            if set(member._roles).intersection(blacklisted_roles):
-                voice_members.remove((user_id, guild_id, channel_id))
+        assert self.voice_sessions is not None
+        closed, self.closed_sessions = self.closed_sessions, []
+        sessions = closed
+        if include_open:
+            sessions = closed + self.voice_sessions.unsaved()
+        if not sessions:
+            return
+        try:
+            async with self.bot.database() as db:
+                await db.conn.executemany(
+                    """
+                    INSERT INTO
+                        voice_sessions
+                        (
+                            guild_id,
+                            user_id,
+                            channel_id,
+                            session_start,
+                            session_end,
+                            eligible_minutes
+                        )
+                    VALUES
+                        ($1, $2, $3, $4, $5, $6)
+                    ON CONFLICT
+                        (guild_id, user_id, session_start)
+                    DO UPDATE
+                    SET
+                        session_end = excluded.session_end,
+                        eligible_minutes = excluded.eligible_minutes
+                    """,
+                    [i.as_row() for i in sessions],
+                )
+        except Exception as e:
+            self.logger.error(f"Failed to save {len(sessions)} voice sessions", exc_info=e)
+            self.closed_sessions = closed + self.closed_sessions
+            return
+        for session in sessions:
+            session.saved_minutes = session.minutes
+        self.logger.info(f"Saved {len(sessions)} voice sessions")
 
-        now = discord.utils.naive_dt(discord.utils.utcnow())
+    async def scan_guilds(
+            self,
+            eligible: typing.Dict[int, typing.List[typing.Tuple[int, int]]]) -> typing.List[typing.Tuple[int, int, int]]:
+        """
+        Work out which of the eligible (user_id, channel_id) pairs in each of
+        the given guilds should get a point, looking up any members that
+        aren't cached.
+        """
 
-        records: typing.List[
-            typing.Tuple[int, int, dt, int, typing.Literal["voice"]]
-        ]
-        records = [
-            (
-                user_id,
+        # Look up anyone that isn't cached
+        clock = time.monotonic()
+        unresolved: typing.Dict[discord.Guild, typing.Set[int]] = {}
+        for guild_id, guild_members in eligible.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            uncached = self.member_cache.unknown(
                 guild_id,
-                now,
-                channel_id,
-                "voice",
+                (i for i, _ in guild_members if guild.get_member(i) is None),
+                clock,
             )
-            for user_id, guild_id, channel_id in voice_members
-        ]
-
-        if len(records) == 0:
-            self.logger.info("Storing 0 cached VC messages in database")
-            return
+            if uncached:
+                unresolved[guild] = uncached
+        if unresolved:
+            await self.resolve_members(unresolved)
 
-        hourly_counts = collections.Counter()
-        daily_counts = collections.Counter()
-        monthly_counts = collections.Counter()
-
-        for user_id, guild_id, timestamp, channel_id, source in records:
-            hour = timestamp.replace(minute=0, second=0, microsecond=0)
-            day = timestamp.date()
-            month = timestamp.replace(
-                day=1,
-                hour=0,
-                minute=0,
-                second=0,
-                microsecond=0,
-            ).date()
-
-            key = (guild_id, user_id, source)
-
-            hourly_counts[(*key, hour)] += 1
-            daily_counts[(*key, day)] += 1
-            monthly_counts[(*key, month)] += 1
-
-        self.logger.info(f"Storing {len(records)} cached VC minutes in database")
-
-        async with self.bot.database() as db:
-            await db.conn.copy_records_to_table(
-                'user_points',
-                columns=(
-                    'user_id',
-                    'guild_id',
-                    'timestamp',
-                    'channel_id',
-                    'source',
-                ),
-                records=records,
-            )
+        voice_members: typing.List[typing.Tuple[int, int, int]] = []
+        for guild_id, guild_members in eligible.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            guild_filter = utils.filters.GuildFilters.get(self.bot, guild_id)
+            for user_id, channel_id in guild_members:
+                member = guild.get_member(user_id) or self.member_cache.get(guild_id, user_id, clock)
+                if member is None:
+                    continue
+
+                # Bots that weren't cached when they joined are only found now
+                if member.bot:
+                    self.voice_tracker.set_state(guild_id, user_id, None, False)
+                    continue
+                if guild_filter.voice_blocked(member._roles):
+                    continue
+                voice_members.append((user_id, guild_id, channel_id))
+        return voice_members
 
-            await db.conn.executemany(
-                """
-                INSERT INTO user_point_hourly_counts (
-                    guild_id,
-                    user_id,
-                    source,
-                    hour,
-                    points
-                )
-                VALUES ($1, $2, $3::point_source, $4, $5)
-                ON CONFLICT (guild_id, user_id, hour, source)
-                DO UPDATE SET points = user_point_hourly_counts.points + EXCLUDED.points
-                """,
-                [
-                    (guild_id, user_id, source, hour, points)
-                    for (guild_id, user_id, source, hour), points
-                    in hourly_counts.items()
-                ],
-            )
+    @tasks.loop(minutes=1)
+    async def user_vc_databaser(self):
+        """
+        Queues a point for every valid voice member to be saved. Guilds are
+        handled in slices spread across the minute, each guild once.
+        """
 
-            await db.conn.executemany(
-                """
-                INSERT INTO user_point_daily_counts (
-                    guild_id,
-                    user_id,
-                    source,
-                    day,
-                    points
-                )
-                VALUES ($1, $2, $3::point_source, $4, $5)
-                ON CONFLICT (guild_id, user_id, day, source)
-                DO UPDATE SET points = user_point_daily_counts.points + EXCLUDED.points
-                """,
-                [
-                    (guild_id, user_id, source, day, points)
-                    for (guild_id, user_id, source, day), points
-                    in daily_counts.items()
-                ],
-            )
+        now = discord.utils.naive_dt(discord.utils.utcnow())
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.member_cache.expire(time.monotonic())
 
-            await db.conn.executemany(
-                """
-                INSERT INTO user_point_monthly_counts (
-                    guild_id,
-                    user_id,
-                    source,
-                    month,
-                    points
-                )
-                VALUES ($1, $2, $3::point_source, $4, $5)
-                ON CONFLICT (guild_id, user_id, month, source)
-                DO UPDATE SET points = user_point_monthly_counts.points + EXCLUDED.points
-                """,
-                [
-                    (guild_id, user_id, source, month, points)
-                    for (guild_id, user_id, source, month), points
-                    in monthly_counts.items()
-                ],
-            )
+        # Group the eligible members by guild
+        eligible: typing.Dict[int, typing.List[typing.Tuple[int, int]]] = {}
+        for user_id, guild_id, channel_id in self.voice_tracker.eligible_members():
+            eligible.setdefault(guild_id, []).append((user_id, channel_id))
+        ordered = sorted(eligible, key=self.scan_pacer.phase)
 
-        for user_id, guild_id, timestamp, channel_id, source in records:
-            utils.cache.PointHolder.add_point(
-                user_id,
-                guild_id,
-                utils.cache.PointSource["voice"],
-                timestamp,
-            )
+        # Work through the guilds as their slot in the minute comes round
+        voice_members: typing.List[typing.Tuple[int, int, int]] = []
+        index = 0
+        while index < len(ordered):
+            end = self.scan_pacer.take(ordered, index, loop.time() - started)
+            delay = 0.0
+            if end == index:
+                delay = max(started + self.scan_pacer.due_at(ordered[index]) - loop.time(), 0.0)
+            else:
+                scanned = await self.scan_guilds({i: eligible[i] for i in ordered[index:end]})
+                for user_id, guild_id, channel_id in scanned:
+                    utils.ingest.PointIngest.push(
+                        user_id,
+                        guild_id,
+                        utils.cache.PointSource.voice,
+                        timestamp=now,
+                        channel_id=channel_id,
+                    )
+                voice_members.extend(scanned)
+                index = end
+            requested = loop.time()
+            await asyncio.sleep(delay)
+            self.scan_pacer.record_lag(loop.time() - requested - delay)
+        self.logger.info(f"Queued {len(voice_members)} VC minutes to be stored from {len(ordered)} guilds")
+
+        # Keep track of sessions, writing them when they close or every so often
+        if self.voice_sessions is None:
+            return
+        self.closed_sessions.extend(self.voice_sessions.tick(now, voice_members))
+        checkpoint = now - self.last_session_checkpoint >= self.session_checkpoint
+        if checkpoint:
+            self.last_session_checkpoint = now
+        if self.closed_sessions or checkpoint:
+            await self.save_voice_sessions(include_open=checkpoint)
 
 
 def setup(bot: vbu.Bot):
@@ -1,8 +1,28 @@
+from . import bulk_load
 from . import cache_tools as cache
+from . import checks
+from . import guild_filters as filters
+from . import ingest
+from . import journal
+from . import member_cache as members
+from . import point_snapshot as snapshot
+from . import rate_limit
+from . import reconcile
 from . import types
+from . import voice_tracker as voice
 
 
 __all__ = (
+    "bulk_load",
     "cache",
+    "checks",
+    "filters",
+    "ingest",
+    "journal",
+    "members",
+    "rate_limit",
+    "reconcile",
+    "snapshot",
     "types",
+    "voice",
 )
@@ -0,0 +1,189 @@
+"""
+Bulk loading of the rollup tables straight into PointSeries arrays.
+
+Rather than returning one row per bucket, the query built here has Postgres
+group each (guild, user) series into a single row, with the bucket keys and
+each source's running totals packed into bytea columns via int4send and
+float8send. The result is streamed with COPY ... TO STDOUT (FORMAT binary) and
+each packed column is copied directly into a typed array, so no Python objects
+are created per bucket.
+"""
+
+from __future__ import annotations
+
+from array import array
+import struct
+import sys
+from typing import Iterator, Optional
+
+from .cache_tools import PointSeries, PointSource
+
+
+__all__ = (
+    "build_series_query",
+    "SeriesCopyDecoder",
+)
+
+
+# {bucket: SQL expression turning the bucket column into a PointSeries key}
+KEY_EXPRESSIONS = {
+    "hour": "FLOOR(EXTRACT(EPOCH FROM {column}) / 3600)::INTEGER",
+    "day": "({column} - DATE '1970-01-01')",
+    "month": "(EXTRACT(YEAR FROM {column}) * 12 + EXTRACT(MONTH FROM {column}) - 1)::INTEGER",
+}
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_HEADER = struct.Struct("!11sii")
+FIELD_COUNT = struct.Struct("!h")
+FIELD_LENGTH = struct.Struct("!i")
+INT8 = struct.Struct("!q")
+
+_SWAP = sys.byteorder != "big"
+
+
+def build_series_query(
+        bucket: str,
+        table: str,
+        column: str,
+        where_clause: str = "") -> str:
+    """
+    Build a query that outputs one row per (guild, user) series of a rollup
+    table, as (guild_id, user_id, keys, *source running totals). This is meant
+    to be run through COPY in binary format.
+    """
+
+    key = KEY_EXPRESSIONS[bucket].format(column=column)
+    source_points = ",\n                    ".join(
+        f"COALESCE(SUM(points) FILTER (WHERE source = '{source.name}'), 0) AS {source.name}"
+        for source in PointSource
+    )
+    running_totals = ",\n                ".join(
+        f"SUM({source.name}) OVER series AS {source.name}"
+        for source in PointSource
+    )
+    packed_totals = ",\n            ".join(
+        f"STRING_AGG(FLOAT8SEND({source.name}), ''::BYTEA ORDER BY bucket_key)"
+        for source in PointSource
+    )
+    return f"""
+        SELECT
+            guild_id,
+            user_id,
+            STRING_AGG(INT4SEND(bucket_key), ''::BYTEA ORDER BY bucket_key),
+            {packed_totals}
+        FROM (
+            SELECT
+                guild_id,
+                user_id,
+                bucket_key,
+                {running_totals}
+            FROM (
+                SELECT
+                    guild_id,
+                    user_id,
+                    {key} AS bucket_key,
+                    {source_points}
+                FROM
+                    {table}
+                {where_clause}
+                GROUP BY
+                    guild_id,
+                    user_id,
+                    bucket_key
+            ) buckets
+            WINDOW series AS (
+                PARTITION BY guild_id, user_id
+                ORDER BY bucket_key
+            )
+        ) running
+        GROUP BY
+            guild_id,
+            user_id
+    """
+
+
+def _network_array(typecode: str, data: memoryview) -> array:
+    output = array(typecode)
+    output.frombytes(data)
+    if _SWAP:
+        output.byteswap()
+    return output
+
+
+class SeriesCopyDecoder:
+    """
+    Incrementally decodes the binary COPY output of a query from
+    build_series_query into (guild_id, user_id, series) tuples.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.header_read = False
+        self.finished = False
+
+    def feed(self, data: bytes) -> Iterator[tuple[int, int, PointSeries]]:
+        """
+        Add a chunk of COPY output, yielding every series that is now
+        complete.
+        """
+
+        self.buffer.extend(data)
+        offset = 0
+        with memoryview(self.buffer) as view:
+            if not self.header_read:
+                if len(view) < COPY_HEADER.size:
+                    return
+                signature, _, extension_length = COPY_HEADER.unpack_from(view)
+                if signature != COPY_SIGNATURE:
+                    raise ValueError("Invalid binary COPY signature")
+                offset = COPY_HEADER.size + extension_length
+                self.header_read = True
+
+            while not self.finished:
+                parsed = self._read_tuple(view, offset)
+                if parsed is None:
+                    break
+                offset, series = parsed
+                if series is not None:
+                    yield series
+        del self.buffer[:offset]
+
+    def _read_tuple(
+            self,
+            view: memoryview,
+            offset: int) -> Optional[tuple[int, Optional[tuple[int, int, PointSeries]]]]:
+        """
+        Read a single tuple starting at the given offset, returning the offset
+        after it and the decoded series, or None if the tuple isn't complete.
+        """
+
+        if offset + FIELD_COUNT.size > len(view):
+            return None
+        field_count, = FIELD_COUNT.unpack_from(view, offset)
+        offset += FIELD_COUNT.size
+        if field_count == -1:
+            self.finished = True
+            return offset, None
+
+        fields: list[memoryview] = []
+        for _ in range(field_count):
+            if offset + FIELD_LENGTH.size > len(view):
+                return None
+            length, = FIELD_LENGTH.unpack_from(view, offset)
+            offset += FIELD_LENGTH.size
+            if offset + length > len(view):
+                return None
+            fields.append(view[offset:offset + length])
+            offset += length
+
+        guild_id, = INT8.unpack(fields[0])
+        user_id, = INT8.unpack(fields[1])
+        series = PointSeries()
+        series.keys = _network_array("i", fields[2])
+        series.columns = tuple(
+            _network_array("d", i)
+            for i in fields[3:]
+        )
+        for i in fields:
+            i.release()
+        return offset, (guild_id, user_id, series)
@@ -1,15 +1,34 @@
 from __future__ import annotations
 
-from datetime import datetime as dt, timedelta
+from array import array
+import asyncio
+from bisect import bisect_left
+from datetime import date, datetime as dt, timedelta, timezone
 from enum import Enum, auto
 from dataclasses import dataclass
 import collections
-from typing import AsyncGenerator, ClassVar, Iterable, Optional, Union, cast
+from contextlib import asynccontextmanager
+from typing import (
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    ClassVar,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Union,
+    cast,
+)
+
+from sortedcontainers import SortedList
 
 
 __all__ = (
     "PointSource",
     "CachedPoint",
+    "PointSeries",
+    "BucketView",
     "PointHolder",
 )
 
@@ -24,6 +43,65 @@ class PointSource(Enum):
     minecraft = auto()
 
 
+# Column index for each point source inside of a PointSeries
+_SOURCES: tuple[PointSource, ...] = tuple(PointSource)
+_SOURCE_INDEX: dict[PointSource, int] = {
+    source: index
+    for index, source in enumerate(_SOURCES)
+}
+
+_EPOCH = dt(1970, 1, 1)
+_HOUR = timedelta(hours=1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _naive(timestamp: Union[dt, date]) -> dt:
+    if not isinstance(timestamp, dt):
+        return dt.combine(timestamp, dt.min.time())
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def _hour_key(timestamp: Union[dt, date]) -> int:
+    return (_naive(timestamp) - _EPOCH) // _HOUR
+
+
+def _day_key(timestamp: Union[dt, date]) -> int:
+    return (_naive(timestamp) - _EPOCH).days
+
+
+def _month_key(timestamp: Union[dt, date]) -> int:
+    return timestamp.year * 12 + timestamp.month - 1
+
+
+def _hour_from_key(key: int) -> dt:
+    return _EPOCH + timedelta(hours=key)
+
+
+def _day_from_key(key: int) -> dt:
+    return _EPOCH + timedelta(days=key)
+
+
+def _month_from_key(key: int) -> dt:
+    return dt(key // 12, key % 12 + 1, 1)
+
+
+# {bucket: (timestamp -> key, key -> bucket timestamp)}
+_TIERS: dict[str, tuple[Callable[[Union[dt, date]], int], Callable[[int], dt]]] = {
+    "hour": (_hour_key, _hour_from_key),
+    "day": (_day_key, _day_from_key),
+    "month": (_month_key, _month_from_key),
+}
+
+
+def _get_tier(bucket: str) -> tuple[Callable[[Union[dt, date]], int], Callable[[int], dt]]:
+    try:
+        return _TIERS[bucket]
+    except KeyError:
+        raise ValueError(f"Unknown bucket type: {bucket!r}")
+
+
 @dataclass(slots=True)
 class CachedPoint:
     """
@@ -35,13 +113,249 @@ class CachedPoint:
     user_id: Optional[int] = None
     guild_id: Optional[int] = None
 
+    # How long raw points are kept in the cache for
+    max_age: ClassVar[timedelta] = timedelta(days=31)
+
     @property
     def is_old(self) -> bool:
         """
         Check if the point is old.
         """
 
-        return self.timestamp < dt.utcnow() - timedelta(days=31)
+        return self.timestamp < dt.utcnow() - self.max_age
+
+
+class PointSeries:
+    """
+    Columnar storage for the buckets of a single (guild, user) pair.
+
+    Bucket keys are integer offsets from the epoch (hours, days or months,
+    depending on the tier), kept sorted in a typed array. Each point source
+    gets its own float column, aligned with the keys, holding the running
+    (prefix) total of that source up to and including each bucket. A single
+    bucket is the difference of two neighbouring entries, and the total
+    between any two keys is two binary searches and a subtraction.
+
+    Running totals aren't rebased when old buckets are dropped - instead each
+    source keeps the running total from before its first bucket as a base.
+    """
+
+    __slots__ = ("keys", "columns", "bases")
+
+    def __init__(self):
+        self.keys: array[int] = array("i")
+        self.columns: tuple[array[float], ...] = tuple(
+            array("d")
+            for _ in _SOURCES
+        )
+        self.bases: array[float] = array("d", [0.0] * len(_SOURCES))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def index(self, key: int) -> Optional[int]:
+        """
+        Get the index of a given key, or None if it isn't stored.
+        """
+
+        keys = self.keys
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            return index
+        return None
+
+    def add(self, key: int, source: PointSource, value: float) -> None:
+        """
+        Add a value to the bucket for the given key, creating it if needed.
+        """
+
+        keys = self.keys
+
+        # Points almost always land in the newest bucket
+        if keys and keys[-1] == key:
+            index = len(keys) - 1
+        else:
+            index = bisect_left(keys, key)
+            if index == len(keys) or keys[index] != key:
+                keys.insert(index, key)
+                for column, base in zip(self.columns, self.bases):
+                    column.insert(index, column[index - 1] if index else base)
+
+        # Move every running total from this bucket onwards
+        column = self.columns[_SOURCE_INDEX[source]]
+        for i in range(index, len(column)):
+            column[i] += value
+
+    def merge(self, other: PointSeries) -> None:
+        """
+        Set every bucket that's in the other series to its values there,
+        keeping the buckets that aren't. The keys and running totals are
+        rebuilt in a single pass over both series.
+        """
+
+        keys, other_keys = self.keys, other.keys
+        if not other_keys:
+            return
+
+        # Loaded buckets are usually all newer than what's already here
+        if not keys or keys[-1] < other_keys[0]:
+            keys.extend(other_keys)
+            for column, base, other_column, other_base in zip(
+                    self.columns, self.bases, other.columns, other.bases):
+                offset = (column[-1] if column else base) - other_base
+                column.extend(offset + i for i in other_column)
+            return
+
+        merged_keys: array[int] = array("i")
+        merged_columns = tuple(array("d") for _ in _SOURCES)
+        totals = [0.0] * len(_SOURCES)
+        index = other_index = 0
+        while index < len(keys) or other_index < len(other_keys):
+            if other_index == len(other_keys) or (
+                    index < len(keys) and keys[index] < other_keys[other_index]):
+                series, series_index = self, index
+                index += 1
+            else:
+                if index < len(keys) and keys[index] == other_keys[other_index]:
+                    index += 1
+                series, series_index = other, other_index
+                other_index += 1
+            merged_keys.append(series.keys[series_index])
+            for source_index, column in enumerate(merged_columns):
+                totals[source_index] += series.value(series_index, source_index)
+                column.append(totals[source_index])
+        self.keys = merged_keys
+        self.columns = merged_columns
+        self.bases = array("d", [0.0] * len(_SOURCES))
+
+    def value(self, index: int, source_index: int) -> float:
+        """
+        Get the points for a single source in the bucket at the given index.
+        """
+
+        column = self.columns[source_index]
+        if index:
+            return column[index] - column[index - 1]
+        return column[index] - self.bases[source_index]
+
+    def counter(self, index: int) -> collections.Counter[PointSource]:
+        """
+        Build a source counter for the bucket at the given index.
+        """
+
+        counter: collections.Counter[PointSource] = collections.Counter()
+        for source_index, source in enumerate(_SOURCES):
+            value = self.value(index, source_index)
+            if value:
+                counter[source] = value
+        return counter
+
+    def source_totals(
+            self,
+            start: int = 0,
+            end: Optional[int] = None) -> dict[PointSource, float]:
+        """
+        Get the per-source totals for the buckets in the index range
+        [start, end).
+        """
+
+        if end is None:
+            end = len(self.keys)
+        if end <= start:
+            return {source: 0.0 for source in _SOURCES}
+        return {
+            source: column[end - 1] - (column[start - 1] if start else base)
+            for source, column, base in zip(_SOURCES, self.columns, self.bases)
+        }
+
+    def source_totals_between(
+            self,
+            start_key: int,
+            end_key: Optional[int] = None) -> dict[PointSource, float]:
+        """
+        Get the per-source totals for the buckets with keys in the range
+        [start_key, end_key).
+        """
+
+        keys = self.keys
+        return self.source_totals(
+            bisect_left(keys, start_key),
+            None if end_key is None else bisect_left(keys, end_key),
+        )
+
+    def truncate(self, key: int) -> list[tuple[int, tuple[float, ...]]]:
+        """
+        Remove every bucket with a key before the one given, returning the
+        removed buckets as (key, per-source values).
+        """
+
+        end = bisect_left(self.keys, key)
+        if end == 0:
+            return []
+        removed = [
+            (
+                self.keys[index],
+                tuple(
+                    self.value(index, source_index)
+                    for source_index in range(len(_SOURCES))
+                ),
+            )
+            for index in range(end)
+        ]
+
+        # Drop the buckets, keeping their running totals as the new bases
+        del self.keys[:end]
+        for source_index, column in enumerate(self.columns):
+            self.bases[source_index] = column[end - 1]
+            del column[:end]
+        return removed
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The number of bytes used by the arrays in this series.
+        """
+
+        return sum(
+            i.itemsize * len(i)
+            for i in (self.keys, *self.columns, self.bases)
+        )
+
+
+_EMPTY_SERIES = PointSeries()
+
+
+class BucketView(Mapping[dt, collections.Counter[PointSource]]):
+    """
+    A read-only mapping of bucket timestamp to source counter, backed by a
+    PointSeries.
+    """
+
+    __slots__ = ("_series", "_to_key", "_from_key")
+
+    def __init__(self, series: PointSeries, bucket: str):
+        self._series = series
+        self._to_key, self._from_key = _get_tier(bucket)
+
+    def __getitem__(self, timestamp: dt) -> collections.Counter[PointSource]:
+        index = self._series.index(self._to_key(timestamp))
+        if index is None:
+            raise KeyError(timestamp)
+        return self._series.counter(index)
+
+    def __iter__(self) -> Iterator[dt]:
+        from_key = self._from_key
+        for key in self._series.keys:
+            yield from_key(key)
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def items(self) -> Iterator[tuple[dt, collections.Counter[PointSource]]]:  # type: ignore
+        series = self._series
+        from_key = self._from_key
+        for index, key in enumerate(series.keys):
+            yield from_key(key), series.counter(index)
 
 
 class PointHolder:
@@ -49,7 +363,10 @@ class PointHolder:
     Holds recent user points.
 
     Raw points are kept for exact lookups/debugging.
-    Hourly/daily/monthly counters are kept for fast graphs.
+    Hourly/daily/monthly buckets are kept for fast graphs, stored as one
+    columnar PointSeries per guild and user. Buckets store the *count* of
+    points per source, the same as the rollup tables; weights are applied
+    when totalling.
     """
 
     # {user_id: {guild_id: [points]}}
@@ -58,37 +375,50 @@ class PointHolder:
         lambda: collections.defaultdict(list),
     )
 
-    # {guild_id: {user_id: {bucket: {source: points}}}}
-    hourly_points: dict[int, dict[int, dict[dt, collections.Counter[PointSource]]]]
-    hourly_points = collections.defaultdict(
-        lambda: collections.defaultdict(
-            lambda: collections.defaultdict(collections.Counter)
-        )
-    )
-    daily_points: dict[int, dict[int, dict[dt, collections.Counter[PointSource]]]]
-    daily_points = collections.defaultdict(
-        lambda: collections.defaultdict(
-            lambda: collections.defaultdict(collections.Counter)
-        )
-    )
-    monthly_points: dict[int, dict[int, dict[dt, collections.Counter[PointSource]]]]
-    monthly_points = collections.defaultdict(
-        lambda: collections.defaultdict(
-            lambda: collections.defaultdict(collections.Counter)
-        )
-    )
+    # {guild_id: {user_id: series}}
+    hourly_points: ClassVar[dict[int, dict[int, PointSeries]]] = {}
+    daily_points: ClassVar[dict[int, dict[int, PointSeries]]] = {}
+    monthly_points: ClassVar[dict[int, dict[int, PointSeries]]] = {}
 
-    @staticmethod
-    def _hour_bucket(timestamp: dt) -> dt:
-        return timestamp.replace(minute=0, second=0, microsecond=0)
+    # Live totals over each guild's activity window
+    # {guild_id: days}
+    window_days: ClassVar[dict[int, int]] = {}
+    # {guild_id: first hour key inside the window}
+    window_start: ClassVar[dict[int, int]] = {}
+    # {guild_id: {user_id: weighted points}}
+    window_totals: ClassVar[dict[int, dict[int, float]]] = {}
+    # {guild_id: [(-weighted points, user_id)]}, ordered highest first
+    window_rankings: ClassVar[dict[int, SortedList]] = {}
+    # (guild_id, user_id) -> whether the user is still in the guild; anyone
+    # who isn't is kept out of the window totals
+    window_member_check: ClassVar[Optional[Callable[[int, int], bool]]] = None
 
-    @staticmethod
-    def _day_bucket(timestamp: dt) -> dt:
-        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    # Lazy loading - if a guild loader is set then only guilds in
+    # loaded_guilds are in the cache, and the rest are loaded on first use
+    guild_loader: ClassVar[Optional[Callable[[int], Awaitable[None]]]] = None
+    loaded_guilds: ClassVar[set[int]] = set()
+    _guild_loads: ClassVar[dict[int, asyncio.Task]] = {}
 
-    @staticmethod
-    def _month_bucket(timestamp: dt) -> dt:
-        return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    # Held while points are being written to the database and then the
+    # cache, so that the two can be compared without a flush half done
+    flush_lock: ClassVar[asyncio.Lock] = asyncio.Lock()
+
+    # Cache loads reading from the database, which flushes wait for, so that
+    # every flushed point is either in what a load reads or is added to the
+    # cache after the load is done. Loads can run alongside each other, and
+    # new loads wait for any flush that's waiting
+    _load_condition: ClassVar[asyncio.Condition] = asyncio.Condition(flush_lock)
+    _loads: ClassVar[int] = 0
+    _flushes_waiting: ClassVar[int] = 0
+
+    # Warm-up state - while warming up, only guilds whose tiers are all in
+    # warm_tiers can be read from. Guilds that aren't in warm_tiers are either
+    # in one of the warm_ranges of guild IDs loaded together, still to be
+    # loaded, or loaded on first use if there's a guild loader
+    warming_up: ClassVar[bool] = False
+    warm_tiers: ClassVar[dict[int, set[str]]] = {}
+    # [(lowest guild ID, highest guild ID + 1, loaded tiers)]
+    warm_ranges: ClassVar[list[tuple[int, int, set[str]]]] = []
 
     @staticmethod
     def _point_value(source: PointSource) -> float:
@@ -100,6 +430,368 @@ class PointHolder:
             case PointSource.minecraft:
                 return 0.2
 
+    @classmethod
+    def _tier_storage(cls, bucket: str) -> dict[int, dict[int, PointSeries]]:
+        match bucket:
+            case "hour":
+                return cls.hourly_points
+            case "day":
+                return cls.daily_points
+            case "month":
+                return cls.monthly_points
+            case _:
+                raise ValueError(f"Unknown bucket type: {bucket!r}")
+
+    @classmethod
+    def _get_series(
+            cls,
+            user_id: int,
+            guild_id: int,
+            bucket: str,
+            *,
+            create: bool = False) -> PointSeries:
+        """
+        Get the series for a user in a guild. If it doesn't exist and we're not
+        creating it, a shared empty series is returned.
+        """
+
+        storage = cls._tier_storage(bucket)
+        if not create:
+            return storage.get(guild_id, {}).get(user_id, _EMPTY_SERIES)
+        guild_series = storage.setdefault(guild_id, {})
+        series = guild_series.get(user_id)
+        if series is None:
+            series = guild_series[user_id] = PointSeries()
+        return series
+
+    @classmethod
+    def is_guild_loaded(cls, guild_id: int) -> bool:
+        """
+        Whether or not a guild's buckets are in the cache.
+        """
+
+        return cls.guild_loader is None or guild_id in cls.loaded_guilds
+
+    @classmethod
+    def start_warm_up(cls, guild_ids: Iterable[int]) -> None:
+        """
+        Mark the cache as warming up, with the given guilds queued to be
+        loaded.
+        """
+
+        cls.warming_up = True
+        cls.warm_tiers = {
+            guild_id: set()
+            for guild_id in guild_ids
+        }
+        cls.warm_ranges = []
+
+    @classmethod
+    def mark_tiers_loaded(
+            cls,
+            guild_ids: Iterable[int],
+            *buckets: str) -> None:
+        """
+        Mark the given tiers as being fully loaded for the given guilds.
+        """
+
+        for guild_id in guild_ids:
+            cls.warm_tiers.setdefault(guild_id, set()).update(buckets)
+
+    @classmethod
+    def mark_range_loaded(cls, lower: int, upper: int, *buckets: str) -> None:
+        """
+        Mark the given tiers as being fully loaded for every guild with an ID
+        in [lower, upper) that isn't tracked by itself in warm_tiers.
+        """
+
+        for range_lower, range_upper, tiers in cls.warm_ranges:
+            if (range_lower, range_upper) == (lower, upper):
+                tiers.update(buckets)
+                return
+        cls.warm_ranges.append((lower, upper, set(buckets)))
+
+    @classmethod
+    def finish_warm_up(cls) -> None:
+        """
+        Mark every guild as being loaded.
+        """
+
+        cls.warming_up = False
+        cls.warm_tiers.clear()
+        cls.warm_ranges = []
+
+    @classmethod
+    def is_guild_ready(cls, guild_id: int, bucket: Optional[str] = None) -> bool:
+        """
+        Whether or not a guild's buckets can be read from - either for a
+        single tier, or for every tier if one isn't given.
+        """
+
+        if not cls.warming_up:
+            return True
+        tiers = cls.warm_tiers.get(guild_id)
+        if tiers is None:
+            for lower, upper, range_tiers in cls.warm_ranges:
+                if lower <= guild_id < upper:
+                    tiers = range_tiers
+                    break
+            else:
+                return cls.guild_loader is not None
+        if bucket is None:
+            return len(tiers) == len(_TIERS)
+        return bucket in tiers
+
+    @classmethod
+    @asynccontextmanager
+    async def loading(cls) -> AsyncGenerator[None, None]:
+        """
+        Hold off flushes while reading buckets from the database into the
+        cache.
+        """
+
+        async with cls._load_condition:
+            await cls._load_condition.wait_for(lambda: not cls._flushes_waiting)
+            cls._loads += 1
+        try:
+            yield
+        finally:
+            async with cls._load_condition:
+                cls._loads -= 1
+                cls._load_condition.notify_all()
+
+    @classmethod
+    @asynccontextmanager
+    async def flushing(cls) -> AsyncGenerator[None, None]:
+        """
+        Hold the flush lock once no cache loads are running, for writing
+        points to the database and then the cache.
+        """
+
+        async with cls._load_condition:
+            cls._flushes_waiting += 1
+            try:
+                await cls._load_condition.wait_for(lambda: not cls._loads)
+            finally:
+                cls._flushes_waiting -= 1
+            try:
+                yield
+            finally:
+                cls._load_condition.notify_all()
+
+    @classmethod
+    async def ensure_guild(cls, guild_id: int) -> None:
+        """
+        Make sure that a guild's buckets are in the cache, loading them if
+        needed. Concurrent calls for the same guild share a single load.
+        """
+
+        if cls.is_guild_loaded(guild_id):
+            return
+        task = cls._guild_loads.get(guild_id)
+        if task is None:
+            task = asyncio.create_task(cls._load_guild(guild_id))
+            cls._guild_loads[guild_id] = task
+        await asyncio.shield(task)
+
+    @classmethod
+    async def _load_guild(cls, guild_id: int) -> None:
+        assert cls.guild_loader
+        try:
+            # Points flushed before the load are read from the database, and
+            # any after it are added once the guild is marked as loaded
+            async with cls.loading():
+                await cls.guild_loader(guild_id)
+                cls.loaded_guilds.add(guild_id)
+        finally:
+            del cls._guild_loads[guild_id]
+
+    @classmethod
+    def add_to_bucket(
+            cls,
+            user_id: int,
+            guild_id: int,
+            timestamp: Union[dt, date],
+            source: PointSource,
+            points: float,
+            *,
+            bucket: str = "hour") -> None:
+        """
+        Add a pre-counted number of points to a single bucket, as read from
+        the rollup tables.
+        """
+
+        to_key, _ = _get_tier(bucket)
+        key = to_key(timestamp)
+        (
+            cls._get_series(user_id, guild_id, bucket, create=True)
+            .add(key, source, points)
+        )
+
+        # Keep the guild's running window total up to date
+        if bucket == "hour" and key >= cls.window_start.get(guild_id, key + 1):
+            cls._change_window_total(
+                guild_id,
+                user_id,
+                cls._point_value(source) * points,
+            )
+
+    @classmethod
+    def set_bucket(
+            cls,
+            user_id: int,
+            guild_id: int,
+            timestamp: Union[dt, date],
+            source: PointSource,
+            points: float,
+            *,
+            bucket: str = "hour") -> None:
+        """
+        Set the number of points in a single bucket, as read from the rollup
+        tables. Unlike add_to_bucket this is safe to repeat.
+        """
+
+        to_key, _ = _get_tier(bucket)
+        series = cls._get_series(user_id, guild_id, bucket)
+        index = series.index(to_key(timestamp))
+        current = 0.0 if index is None else series.value(index, _SOURCE_INDEX[source])
+        if points != current:
+            cls.add_to_bucket(
+                user_id,
+                guild_id,
+                timestamp,
+                source,
+                points - current,
+                bucket=bucket,
+            )
+
+    @classmethod
+    def repair_series(
+            cls,
+            user_id: int,
+            guild_id: int,
+            start_key: int,
+            cells: dict[tuple[int, PointSource], float],
+            *,
+            bucket: str = "hour") -> None:
+        """
+        Make a user's buckets from the given key onwards match the given
+        {(key, source): points} cells, as read from the rollup tables.
+        """
+
+        _, from_key = _get_tier(bucket)
+        series = cls._get_series(user_id, guild_id, bucket)
+        for index in range(bisect_left(series.keys, start_key), len(series)):
+            key = series.keys[index]
+            for source_index, source in enumerate(_SOURCES):
+                if (key, source) not in cells and series.value(index, source_index):
+                    cls.set_bucket(user_id, guild_id, from_key(key), source, 0, bucket=bucket)
+        for (key, source), points in cells.items():
+            cls.set_bucket(user_id, guild_id, from_key(key), source, points, bucket=bucket)
+
+    @classmethod
+    def load_series(
+            cls,
+            user_id: int,
+            guild_id: int,
+            series: PointSeries,
+            *,
+            bucket: str = "hour") -> None:
+        """
+        Replace a user's whole series for a tier, dropping the guild's live
+        window so that it's rebuilt on next use.
+        """
+
+        cls._tier_storage(bucket).setdefault(guild_id, {})[user_id] = series
+        if bucket == "hour":
+            cls.window_days.pop(guild_id, None)
+            cls.window_start.pop(guild_id, None)
+
+    @classmethod
+    def merge_series(
+            cls,
+            user_id: int,
+            guild_id: int,
+            series: PointSeries,
+            *,
+            bucket: str = "hour") -> None:
+        """
+        Put a series read from the database into the cache. If the user
+        already has buckets in that tier then the loaded buckets are set on
+        the existing series, the same as set_bucket would, rather than
+        replacing it.
+        """
+
+        existing = cls._get_series(user_id, guild_id, bucket)
+        if not existing:
+            cls.load_series(user_id, guild_id, series, bucket=bucket)
+            return
+        existing.merge(series)
+        if bucket == "hour":
+            cls.window_days.pop(guild_id, None)
+            cls.window_start.pop(guild_id, None)
+
+    @classmethod
+    def fold_tier(
+            cls,
+            guild_id: int,
+            source_bucket: str,
+            target_bucket: str,
+            *,
+            after: dt,
+            before: Optional[dt] = None) -> None:
+        """
+        Add a guild's buckets from one tier into a coarser tier, for every
+        bucket that starts at or after `after` and before `before`.
+        """
+
+        _, from_key = _get_tier(source_bucket)
+        to_target_key, from_target_key = _get_tier(target_bucket)
+        start = cls._first_key_after(after, source_bucket)
+        end = None if before is None else cls._first_key_after(before, source_bucket)
+
+        # Users share bucket keys, so only convert each one once
+        target_keys: dict[int, int] = {}
+
+        guild_series = cls._tier_storage(source_bucket).get(guild_id, {})
+        for user_id, series in list(guild_series.items()):
+            keys = series.keys
+            totals: dict[int, list[float]] = {}
+            stop = len(keys) if end is None else bisect_left(keys, end)
+            for index in range(bisect_left(keys, start), stop):
+                key = keys[index]
+                target_key = target_keys.get(key)
+                if target_key is None:
+                    target_key = target_keys[key] = to_target_key(from_key(key))
+                target_totals = totals.setdefault(target_key, [0.0] * len(_SOURCES))
+                for source_index in range(len(_SOURCES)):
+                    target_totals[source_index] += series.value(index, source_index)
+            for target_key, target_totals in totals.items():
+                for source, value in zip(_SOURCES, target_totals):
+                    if value:
+                        cls.add_to_bucket(
+                            user_id,
+                            guild_id,
+                            from_target_key(target_key),
+                            source,
+                            value,
+                            bucket=target_bucket,
+                        )
+
+    @classmethod
+    def derive_tiers(cls, guild_id: int, hourly_start: dt) -> None:
+        """
+        Build a guild's daily and monthly buckets from its hourly buckets,
+        from the (day aligned) start of the loaded hourly data onwards. The
+        month that the hourly data starts in is completed from the daily
+        buckets before it.
+        """
+
+        month_start = hourly_start.replace(day=1)
+        cls.fold_tier(guild_id, "day", "month", after=month_start, before=hourly_start)
+        cls.fold_tier(guild_id, "hour", "day", after=hourly_start)
+        cls.fold_tier(guild_id, "hour", "month", after=hourly_start)
+
     @classmethod
     def add_point(
             cls,
@@ -120,11 +812,131 @@ class PointHolder:
         )
         cls.all_points[user_id][guild_id].append(point)
 
-        # Add to the cache buckets
-        value = cls._point_value(source)
-        cls.hourly_points[guild_id][user_id][cls._hour_bucket(timestamp)][source] += value  # pyright: ignore
-        cls.daily_points[guild_id][user_id][cls._day_bucket(timestamp)][source] += value  # pyright: ignore
-        cls.monthly_points[guild_id][user_id][cls._month_bucket(timestamp)][source] += value  # pyright: ignore
+        # Guilds that haven't been loaded yet will read this from the database,
+        # as will guilds that are warming up until their hourly buckets are in
+        if not cls.is_guild_loaded(guild_id) or not cls.is_guild_ready(guild_id, "hour"):
+            return
+
+        # Add to the cache buckets - guilds that are still warming up only
+        # get the hourly bucket, as the rest are built from it once loaded
+        buckets = _TIERS if cls.is_guild_ready(guild_id) else ("hour",)
+        for bucket in buckets:
+            cls.add_to_bucket(
+                user_id,
+                guild_id,
+                timestamp,
+                source,
+                1,
+                bucket=bucket,
+            )
+
+    @classmethod
+    async def compact(
+            cls,
+            *,
+            raw_days: int = 31,
+            hourly_days: int = 90,
+            daily_days: int = 730,
+            monthly_days: int = 0,
+            batch_size: int = 1_000) -> None:
+        """
+        Drop points older than each tier's retention, in days (0 keeping them
+        forever). Expired buckets are folded into the next coarsest tier if
+        it doesn't already cover them. Yields to the event loop after every
+        batch of series, so one huge guild can't hold it up.
+        """
+
+        now = dt.utcnow()
+
+        # Raw points
+        if raw_days:
+            CachedPoint.max_age = timedelta(days=raw_days)
+            for index, user_id in enumerate(list(cls.all_points)):
+                if index % 100 == 0:
+                    await asyncio.sleep(0)
+                user_points = cls.all_points[user_id]
+                for guild_id, points in list(user_points.items()):
+                    points[:] = [i for i in points if not i.is_old]
+                    if not points:
+                        del user_points[guild_id]
+                if not user_points:
+                    del cls.all_points[user_id]
+
+        # Bucketed points
+        tiers = (
+            ("hour", hourly_days, "day"),
+            ("day", daily_days, "month"),
+            ("month", monthly_days, None),
+        )
+        for bucket, days, coarser in tiers:
+            if not days:
+                continue
+            storage = cls._tier_storage(bucket)
+            cutoff = cls._first_key_after(now - timedelta(days=days), bucket)
+            handled = 0
+            for guild_id in list(storage):
+                guild_series = storage.get(guild_id)
+                if guild_series is None:
+                    continue
+                for user_id, series in list(guild_series.items()):
+                    if handled % batch_size == 0:
+                        await asyncio.sleep(0)
+                    handled += 1
+
+                    # The series may have been dropped or replaced while we yielded
+                    if guild_series.get(user_id) is not series:
+                        continue
+
+                    # Never drop buckets that are still inside a live window
+                    guild_cutoff = cutoff
+                    if bucket == "hour" and guild_id in cls.window_start:
+                        guild_cutoff = min(cutoff, cls.window_start[guild_id])
+
+                    expired = series.truncate(guild_cutoff)
+                    if expired and coarser:
+                        cls._fold_buckets(user_id, guild_id, bucket, coarser, expired)
+                    if not series:
+                        del guild_series[user_id]
+                if not guild_series and storage.get(guild_id) is guild_series:
+                    del storage[guild_id]
+
+    @classmethod
+    def _fold_buckets(
+            cls,
+            user_id: int,
+            guild_id: int,
+            bucket: str,
+            coarser: str,
+            expired: list[tuple[int, tuple[float, ...]]]) -> None:
+        """
+        Add expired buckets into a coarser tier, skipping any coarse buckets
+        that already exist (as they were loaded or counted alongside).
+        """
+
+        _, from_key = _get_tier(bucket)
+        to_coarse_key, from_coarse_key = _get_tier(coarser)
+        coarse_series = cls._get_series(user_id, guild_id, coarser)
+
+        missing: dict[int, list[float]] = {}
+        for key, values in expired:
+            coarse_key = to_coarse_key(from_key(key))
+            if coarse_series.index(coarse_key) is not None:
+                continue
+            totals = missing.setdefault(coarse_key, [0.0] * len(_SOURCES))
+            for source_index, value in enumerate(values):
+                totals[source_index] += value
+
+        for coarse_key, totals in missing.items():
+            for source, value in zip(_SOURCES, totals):
+                if value:
+                    cls.add_to_bucket(
+                        user_id,
+                        guild_id,
+                        from_coarse_key(coarse_key),
+                        source,
+                        value,
+                        bucket=coarser,
+                    )
 
     @classmethod
     def get_points(
@@ -171,6 +983,19 @@ class PointHolder:
             if point.timestamp > cutoff
         ]
 
+    @staticmethod
+    def _first_key_after(timestamp: dt, bucket: str = "hour") -> int:
+        """
+        Get the first bucket key whose bucket starts at or after the given
+        timestamp.
+        """
+
+        to_key, from_key = _get_tier(bucket)
+        key = to_key(timestamp)
+        if from_key(key) < _naive(timestamp):
+            key += 1
+        return key
+
     @classmethod
     async def get_guild_points_above_age(
             cls,
@@ -180,21 +1005,18 @@ class PointHolder:
         Get raw points in a guild above a certain age.
         """
 
-        cutoff = dt.utcnow() - timedelta(**age)
+        cutoff_key = cls._first_key_after(dt.utcnow() - timedelta(**age))
 
         people_dict = collections.defaultdict({
             PointSource.message: 0.0,
             PointSource.voice: 0.0,
             PointSource.minecraft: 0.0,
         }.copy)
-        for user_id, user_dict in cls.hourly_points[guild_id].items():
-            for timestamp, source_counter in user_dict.items():
-                if timestamp < cutoff:
-                    continue
-                current = people_dict[user_id]
-                for source, points in source_counter.items():
-                    current[source] += points
-                people_dict[user_id] = current
+        for user_id, series in cls.hourly_points.get(guild_id, {}).items():
+            start = bisect_left(series.keys, cutoff_key)
+            if start == len(series):
+                continue
+            people_dict[user_id] = series.source_totals(start)
 
         return people_dict
 
@@ -205,24 +1027,214 @@ class PointHolder:
             guild_id: int,
             **age) -> float:
 
-        cutoff = dt.utcnow() - timedelta(**age)
+        return cls.get_point_total_between(
+            user_id,
+            guild_id,
+            after=dt.utcnow() - timedelta(**age),
+        )
 
-        totals = {
-            PointSource.message: 0.0,
-            PointSource.voice: 0.0,
-            PointSource.minecraft: 0.0,
-        }
+    @classmethod
+    def get_source_totals_between(
+            cls,
+            user_id: int,
+            guild_id: int,
+            *,
+            after: dt,
+            before: Optional[dt] = None,
+            bucket: str = "hour") -> dict[PointSource, float]:
+        """
+        Get the per-source point counts for a user in a guild, for every
+        bucket that starts at or after `after` and before `before`.
+        """
+
+        series = cls._get_series(user_id, guild_id, bucket)
+        return series.source_totals_between(
+            cls._first_key_after(after, bucket),
+            None if before is None else cls._first_key_after(before, bucket),
+        )
+
+    @classmethod
+    def get_point_total_between(
+            cls,
+            user_id: int,
+            guild_id: int,
+            *,
+            after: dt,
+            before: Optional[dt] = None,
+            bucket: str = "hour") -> float:
+        """
+        Get the weighted point total for a user in a guild, for every
+        bucket that starts at or after `after` and before `before`.
+        """
+
+        totals = cls.get_source_totals_between(
+            user_id,
+            guild_id,
+            after=after,
+            before=before,
+            bucket=bucket,
+        )
+        return cls.total_points(totals)
+
+    @classmethod
+    def _change_window_total(
+            cls,
+            guild_id: int,
+            user_id: int,
+            change: float) -> None:
+        totals = cls.window_totals[guild_id]
+        ranking = cls.window_rankings[guild_id]
+        old_total = totals.pop(user_id, None)
+        if old_total is not None:
+            ranking.remove((-old_total, user_id))
+        elif cls.window_member_check and not cls.window_member_check(guild_id, user_id):
+            return
+        total = (old_total or 0.0) + change
+        if total > 1e-9:
+            totals[user_id] = total
+            ranking.add((-total, user_id))
 
-        bucketed_points = cls.hourly_points[guild_id][user_id]
+    @classmethod
+    def rebuild_window(cls, guild_id: int, days: int) -> None:
+        """
+        Rebuild the running window totals for a guild from its hourly buckets.
+        """
 
-        for bucket_timestamp, source_counter in bucketed_points.items():
-            if bucket_timestamp < cutoff:
+        start = cls._first_key_after(dt.utcnow() - timedelta(days=days))
+        totals: dict[int, float] = {}
+        for user_id, series in cls.hourly_points.get(guild_id, {}).items():
+            if cls.window_member_check and not cls.window_member_check(guild_id, user_id):
                 continue
+            total = cls.total_points(series.source_totals_between(start))
+            if total > 1e-9:
+                totals[user_id] = total
+        cls.window_days[guild_id] = days
+        cls.window_start[guild_id] = start
+        cls.window_totals[guild_id] = totals
+        cls.window_rankings[guild_id] = SortedList(
+            (-total, user_id)
+            for user_id, total in totals.items()
+        )
+
+    @classmethod
+    def remove_window_user(cls, guild_id: int, user_id: int) -> None:
+        """
+        Take a user out of the guild's window totals, eg when they leave it.
+        Their buckets are kept.
+        """
+
+        if guild_id not in cls.window_start:
+            return
+        total = cls.window_totals[guild_id].pop(user_id, None)
+        if total is not None:
+            cls.window_rankings[guild_id].remove((-total, user_id))
+
+    @classmethod
+    def add_window_user(cls, guild_id: int, user_id: int) -> None:
+        """
+        Put a user back into the guild's window totals from their hourly
+        buckets, eg when they rejoin it.
+        """
+
+        if guild_id not in cls.window_start:
+            return
+        cls.remove_window_user(guild_id, user_id)
+        series = cls.hourly_points.get(guild_id, {}).get(user_id)
+        if series is None:
+            return
+        start = cls.window_start[guild_id]
+        cls._change_window_total(
+            guild_id,
+            user_id,
+            cls.total_points(series.source_totals_between(start)),
+        )
 
-            for source, points in source_counter.items():
-                totals[source] += points
+    @classmethod
+    def expire_window(cls, guild_id: int) -> None:
+        """
+        Subtract any hourly buckets that have left the guild's window since
+        it was last moved.
+        """
 
-        return sum([cls._point_value(source) * count for source, count in totals.items()])
+        old_start = cls.window_start[guild_id]
+        new_start = cls._first_key_after(
+            dt.utcnow() - timedelta(days=cls.window_days[guild_id])
+        )
+        if new_start <= old_start:
+            return
+        guild_series = cls.hourly_points.get(guild_id, {})
+        for user_id in list(cls.window_totals[guild_id]):
+            series = guild_series.get(user_id)
+            if series is None:
+                continue
+            expired = series.source_totals_between(old_start, new_start)
+            cls._change_window_total(
+                guild_id,
+                user_id,
+                -cls.total_points(expired),
+            )
+        cls.window_start[guild_id] = new_start
+
+    @classmethod
+    async def expire_windows(cls) -> None:
+        """
+        Move every guild's window forward, subtracting expired buckets.
+        """
+
+        for index, guild_id in enumerate(list(cls.window_start)):
+            if index % 100 == 0:
+                await asyncio.sleep(0)
+            cls.expire_window(guild_id)
+
+    @classmethod
+    def get_window_total(
+            cls,
+            user_id: int,
+            guild_id: int,
+            days: int) -> float:
+        """
+        Get a user's weighted point total over the guild's activity window.
+        The window is rebuilt if its length has changed since it was last used.
+        """
+
+        cls._ensure_window(guild_id, days)
+        return cls.window_totals[guild_id].get(user_id, 0.0)
+
+    @classmethod
+    def _ensure_window(cls, guild_id: int, days: int) -> None:
+        if cls.window_days.get(guild_id) != days:
+            cls.rebuild_window(guild_id, days)
+        else:
+            cls.expire_window(guild_id)
+
+    @classmethod
+    def get_window_user_count(cls, guild_id: int, days: int) -> int:
+        """
+        Get the number of users with points in the guild's activity window.
+        """
+
+        cls._ensure_window(guild_id, days)
+        return len(cls.window_rankings[guild_id])
+
+    @classmethod
+    def get_window_leaderboard(
+            cls,
+            guild_id: int,
+            days: int,
+            *,
+            start: int = 0,
+            stop: Optional[int] = None) -> list[tuple[int, float]]:
+        """
+        Get a slice of the guild's leaderboard over its activity window, as a
+        list of (user_id, weighted points), highest first.
+        """
+
+        cls._ensure_window(guild_id, days)
+        return [
+            (user_id, -negative_total)
+            for negative_total, user_id
+            in cls.window_rankings[guild_id].islice(start, stop)
+        ]
 
     @classmethod
     def get_bucketed_points(
@@ -230,7 +1242,7 @@ class PointHolder:
             user_id: int,
             guild_id: int,
             *,
-            bucket: str = "hour") -> dict[dt, collections.Counter[PointSource]]:
+            bucket: str = "hour") -> Mapping[dt, collections.Counter[PointSource]]:
         """
         Get pre-counted bucket data for graphing.
 
@@ -240,15 +1252,10 @@ class PointHolder:
         - "month"
         """
 
-        match bucket:
-            case "hour":
-                return cls.hourly_points[guild_id][user_id]
-            case "day":
-                return cls.daily_points[guild_id][user_id]
-            case "month":
-                return cls.monthly_points[guild_id][user_id]
-            case _:
-                raise ValueError(f"Unknown bucket type: {bucket!r}")
+        return BucketView(
+            cls._get_series(user_id, guild_id, bucket),
+            bucket,
+        )
 
     @classmethod
     def get_bucket_total(
@@ -262,23 +1269,12 @@ class PointHolder:
         Get total points for a specific bucket.
         """
 
-        buckets = cls.get_bucketed_points(
-            user_id,
-            guild_id,
-            bucket=bucket,
-        )
-
-        match bucket:
-            case "hour":
-                key = cls._hour_bucket(timestamp)
-            case "day":
-                key = cls._day_bucket(timestamp)
-            case "month":
-                key = cls._month_bucket(timestamp)
-            case _:
-                raise ValueError(f"Unknown bucket type: {bucket!r}")
-
-        return sum(buckets[key].values())
+        to_key, _ = _get_tier(bucket)
+        series = cls._get_series(user_id, guild_id, bucket)
+        index = series.index(to_key(timestamp))
+        if index is None:
+            return 0
+        return sum(series.counter(index).values())
 
     @classmethod
     def total_points(
@@ -0,0 +1,32 @@
+from discord.ext import commands, vbu
+
+from .cache_tools import PointHolder
+
+
+__all__ = (
+    "CacheWarmingUp",
+    "guild_cache_is_ready",
+)
+
+
+class CacheWarmingUp(vbu.errors.BotNotReady):
+    """
+    Raised when a command is run in a guild whose points are still being
+    loaded into the cache.
+    """
+
+
+def guild_cache_is_ready():
+    """
+    Check that the points for the guild the command is run in have been
+    loaded into the cache.
+    """
+
+    async def predicate(ctx: vbu.Context) -> bool:
+        if ctx.guild is None or PointHolder.is_guild_ready(ctx.guild.id):
+            return True
+        raise CacheWarmingUp(
+            "This server's points are still warming up after a restart - "
+            "please try again in a minute."
+        )
+    return commands.check(predicate)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import functools
+import inspect
+from typing import Any, Callable, ClassVar, Optional
+
+from discord.ext import vbu
+
+
+__all__ = (
+    "GuildFilter",
+    "GuildFilters",
+)
+
+
+@dataclass(frozen=True, slots=True)
+class GuildFilter:
+    """
+    The blacklists for a single guild, ready for fast membership checks.
+    """
+
+    blacklisted_channels: frozenset[int] = frozenset()
+    blacklisted_text_roles: frozenset[int] = frozenset()
+    blacklisted_vc_roles: frozenset[int] = frozenset()
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> GuildFilter:
+        return cls(
+            blacklisted_channels=frozenset(settings.get('blacklisted_channels', ())),
+            blacklisted_text_roles=frozenset(settings.get('blacklisted_text_roles', ())),
+            blacklisted_vc_roles=frozenset(settings.get('blacklisted_vc_roles', ())),
+        )
+
+    def text_blocked(self, channel_id: int, role_ids: Any) -> bool:
+        """
+        Whether or not a message in the given channel by a member with the
+        given roles is blacklisted from getting points.
+        """
+
+        if channel_id in self.blacklisted_channels:
+            return True
+        return bool(self.blacklisted_text_roles) and not self.blacklisted_text_roles.isdisjoint(role_ids)
+
+    def voice_blocked(self, role_ids: Any) -> bool:
+        """
+        Whether or not a member with the given roles is blacklisted from
+        getting VC points.
+        """
+
+        return bool(self.blacklisted_vc_roles) and not self.blacklisted_vc_roles.isdisjoint(role_ids)
+
+
+_EMPTY_FILTER = GuildFilter()
+
+
+class GuildFilters:
+    """
+    A cache of GuildFilter per guild, built from the guild settings on first
+    use and thrown away whenever the settings they're built from change.
+    """
+
+    filters: ClassVar[dict[int, GuildFilter]] = {}
+
+    @classmethod
+    def get(cls, bot: vbu.Bot, guild_id: int) -> GuildFilter:
+        try:
+            return cls.filters[guild_id]
+        except KeyError:
+            pass
+        settings = bot.guild_settings.get(guild_id)
+        guild_filter = GuildFilter.from_settings(settings) if settings else _EMPTY_FILTER
+        cls.filters[guild_id] = guild_filter
+        return guild_filter
+
+    @classmethod
+    def invalidate(cls, guild_id: Optional[int] = None) -> None:
+        """
+        Throw away the filter for a guild, or for every guild if one isn't
+        given.
+        """
+
+        if guild_id is None:
+            cls.filters.clear()
+        else:
+            cls.filters.pop(guild_id, None)
+
+    @classmethod
+    def invalidating(cls, callback: Callable) -> Callable:
+        """
+        Wrap a settings menu cache callback so that the context guild's
+        filter is rebuilt after it runs.
+        """
+
+        @functools.wraps(callback)
+        def wrapper(ctx: vbu.Context, *args, **kwargs):
+            result = callback(ctx, *args, **kwargs)
+            if inspect.isawaitable(result):
+                async def wait():
+                    try:
+                        return await result
+                    finally:
+                        cls.invalidate(ctx.guild.id)
+                return wait()
+            cls.invalidate(ctx.guild.id)
+            return result
+        return wrapper
@@ -0,0 +1,570 @@
+"""
+A write-behind pipeline for points from every source.
+
+Sources push compact point records into PointIngest as they happen (and into
+a local journal, if one is set up, so that they survive a restart). Every
+flush interval the pending records are written in batches - each batch is
+copied into user_points and pre-aggregated into the hourly, daily and monthly
+rollup tables in a single transaction, after which the points are added to the
+cache.
+"""
+
+from __future__ import annotations
+
+from array import array
+import asyncio
+import collections
+from datetime import datetime as dt, timedelta
+import logging
+import time
+from typing import AsyncContextManager, Callable, ClassVar, NamedTuple, Optional
+
+from discord.ext import vbu
+
+from .cache_tools import (
+    _EPOCH,
+    _MICROSECOND,
+    _SOURCE_INDEX,
+    _SOURCES,
+    PointHolder,
+    PointSource,
+)
+from .journal import PointJournal
+
+
+__all__ = (
+    "PointRecord",
+    "PointBuffer",
+    "PointIngest",
+)
+
+
+class PointRecord(NamedTuple):
+    timestamp: dt
+    user_id: int
+    guild_id: int
+    channel_id: Optional[int]
+    source: PointSource
+
+
+class PointBuffer:
+    """
+    Columnar storage for pending points. Each point is a fixed 33 bytes
+    across a few typed arrays, rather than an object per point.
+    """
+
+    __slots__ = ("timestamps", "user_ids", "guild_ids", "channel_ids", "sources")
+
+    def __init__(self):
+        self.timestamps: array[int] = array("q")  # microseconds since the epoch
+        self.user_ids: array[int] = array("q")
+        self.guild_ids: array[int] = array("q")
+        self.channel_ids: array[int] = array("q")  # 0 for no channel
+        self.sources: array[int] = array("B")
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def append(
+            self,
+            timestamp: dt,
+            user_id: int,
+            guild_id: int,
+            channel_id: Optional[int],
+            source: PointSource) -> None:
+        self.timestamps.append((timestamp - _EPOCH) // _MICROSECOND)
+        self.user_ids.append(user_id)
+        self.guild_ids.append(guild_id)
+        self.channel_ids.append(channel_id or 0)
+        self.sources.append(_SOURCE_INDEX[source])
+
+    def extend(self, other: PointBuffer, start: int = 0) -> None:
+        """
+        Add the points from another buffer, from the given index onwards.
+        """
+
+        for name in self.__slots__:
+            getattr(self, name).extend(getattr(other, name)[start:])
+
+    def clear(self) -> None:
+        for name in self.__slots__:
+            del getattr(self, name)[:]
+
+    def records(self, start: int, end: int) -> list[PointRecord]:
+        """
+        Get the points in the index range [start, end) as records.
+        """
+
+        return [
+            PointRecord(
+                _EPOCH + timedelta(microseconds=timestamp),
+                user_id,
+                guild_id,
+                channel_id or None,
+                _SOURCES[source],
+            )
+            for timestamp, user_id, guild_id, channel_id, source in zip(
+                self.timestamps[start:end],
+                self.user_ids[start:end],
+                self.guild_ids[start:end],
+                self.channel_ids[start:end],
+                self.sources[start:end],
+            )
+        ]
+
+
+# (
+#     table,
+#     bucket column,
+#     function to get the bucket from a point's timestamp,
+#     SQL expression to get the bucket from a point's timestamp,
+# )
+_ROLLUPS: tuple[tuple[str, str, Callable[[dt], object], str], ...] = (
+    (
+        "user_point_hourly_counts",
+        "hour",
+        lambda timestamp: timestamp.replace(minute=0, second=0, microsecond=0),
+        "DATE_TRUNC('hour', timestamp)",
+    ),
+    (
+        "user_point_daily_counts",
+        "day",
+        lambda timestamp: timestamp.date(),
+        "timestamp::DATE",
+    ),
+    (
+        "user_point_monthly_counts",
+        "month",
+        lambda timestamp: timestamp.date().replace(day=1),
+        "DATE_TRUNC('month', timestamp)::DATE",
+    ),
+)
+
+_COPY_COLUMNS = (
+    'timestamp',
+    'user_id',
+    'guild_id',
+    'channel_id',
+    'source',
+)
+
+
+class PointIngest:
+    """
+    Buffers points from every source and writes them to the database (and
+    the cache) in batches.
+    """
+
+    # Points are pushed into the pending buffer, which is swapped out for the
+    # spare when it's flushed
+    pending: ClassVar[PointBuffer] = PointBuffer()
+    _spare: ClassVar[Optional[PointBuffer]] = PointBuffer()
+    _flushing: ClassVar[Optional[PointBuffer]] = None
+
+    # Pending points are written once the oldest is flush_interval seconds
+    # old, or once flush_size points are pending, whichever is first - and
+    # batch_size are written at once
+    flush_interval: ClassVar[float] = 60.0
+    flush_size: ClassVar[int] = 10_000
+    batch_size: ClassVar[int] = 10_000
+
+    # The most points that can be pending - new points are dropped past this
+    max_pending: ClassVar[int] = 1_000_000
+    dropped: ClassVar[int] = 0
+
+    # Failed flushes are retried with exponential backoff, and after enough
+    # failures in a row the circuit opens and nothing is tried for a while
+    max_retry_delay: ClassVar[float] = 60.0
+    breaker_failures: ClassVar[int] = 5
+    breaker_cooldown: ClassVar[float] = 300.0
+    _failures: ClassVar[int] = 0
+
+    # When the oldest pending point was pushed, and an event for waking the
+    # flush loop early
+    _oldest: ClassVar[float] = 0.0
+    _wake: ClassVar[Optional[asyncio.Event]] = None
+
+    # Whether written points are added to this process's cache - processes
+    # without a cache of their own only write to the database
+    update_cache: ClassVar[bool] = True
+
+    # Whether batches go through a staging table so that every rollup is
+    # updated with one set-based statement, rather than one upsert per row
+    staging_copy: ClassVar[bool] = False
+
+    # Whether voice minutes are kept as sessions by the VC handler, in which
+    # case they only go into the rollups and not into user_points
+    voice_sessions: ClassVar[bool] = False
+
+    database: ClassVar[Optional[Callable[[], AsyncContextManager[vbu.Database]]]] = None
+    logger: ClassVar[logging.Logger] = logging.getLogger(__name__)
+    _flush_task: ClassVar[Optional[asyncio.Task]] = None
+
+    # A stop running in the background, which has to finish before the
+    # pipeline is started again
+    stopping: ClassVar[Optional[asyncio.Task]] = None
+
+    # Where pending points are journaled so that they survive a restart, if
+    # anywhere
+    journal: ClassVar[Optional[PointJournal]] = None
+
+    @classmethod
+    def start(
+            cls,
+            database: Callable[[], AsyncContextManager[vbu.Database]],
+            *,
+            flush_interval: float = 60.0,
+            flush_size: int = 10_000,
+            batch_size: int = 10_000,
+            max_pending: int = 1_000_000,
+            max_retry_delay: float = 60.0,
+            breaker_failures: int = 5,
+            breaker_cooldown: float = 300.0,
+            update_cache: bool = True,
+            staging_copy: bool = False,
+            voice_sessions: bool = False,
+            journal_path: Optional[str] = None,
+            logger: Optional[logging.Logger] = None) -> None:
+        """
+        Start flushing pending points in the background, using the given
+        database connection factory. Does nothing if already started.
+
+        If a journal path is given then pending points are journaled there,
+        and anything left in the journal from before is queued again.
+        """
+
+        if cls._flush_task is not None and not cls._flush_task.done():
+            return
+        cls.database = database
+        cls.flush_interval = flush_interval
+        cls.flush_size = flush_size
+        cls.batch_size = batch_size
+        cls.max_pending = max_pending
+        cls.max_retry_delay = max_retry_delay
+        cls.breaker_failures = breaker_failures
+        cls.breaker_cooldown = breaker_cooldown
+        cls.update_cache = update_cache
+        cls.staging_copy = staging_copy
+        cls.voice_sessions = voice_sessions
+        if logger is not None:
+            cls.logger = logger
+        if journal_path is not None and cls.journal is None:
+            cls.journal = PointJournal(journal_path)
+            replayed = cls.journal.replay()
+            for point in replayed:
+                cls.pending.append(*point)
+            cls._oldest = time.monotonic()
+            cls.logger.info(f"Replayed {len(replayed)} points from journal")
+            cls.journal.start()
+        cls._flush_task = asyncio.create_task(cls._flush_loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        """
+        Stop flushing in the background, writing anything that's still
+        pending.
+        """
+
+        # Let a flush that's in progress put back what it didn't write before
+        # flushing everything that's left
+        if cls._flush_task is not None:
+            flush_task, cls._flush_task = cls._flush_task, None
+            flush_task.cancel()
+            try:
+                await flush_task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await cls.flush()
+        finally:
+            if cls.journal is not None:
+                await cls.journal.close()
+                cls.journal = None
+
+    @classmethod
+    def push(
+            cls,
+            user_id: int,
+            guild_id: int,
+            source: PointSource,
+            *,
+            timestamp: Optional[dt] = None,
+            channel_id: Optional[int] = None) -> None:
+        """
+        Queue a point to be written. If there are already max_pending points
+        waiting then the point is dropped.
+        """
+
+        pending = len(cls.pending)
+        if pending >= cls.max_pending:
+            cls.dropped += 1
+            return
+        timestamp = timestamp or dt.utcnow()
+        cls.pending.append(timestamp, user_id, guild_id, channel_id, source)
+
+        # Let the flush loop know if it needs to start timing or to flush now
+        if pending == 0:
+            cls._oldest = time.monotonic()
+        if (pending == 0 or pending + 1 == cls.flush_size) and cls._wake is not None:
+            cls._wake.set()
+        if cls.journal is not None:
+            cls.journal.append(timestamp, user_id, guild_id, channel_id, source)
+
+    @classmethod
+    async def _flush_loop(cls) -> None:
+        cls._wake = asyncio.Event()
+        while True:
+
+            # Wait for there to be something to write, and for it to be old
+            # enough or for there to be enough of it
+            if not cls.pending:
+                await cls._wake.wait()
+                cls._wake.clear()
+                continue
+            wait = cls._oldest + cls.flush_interval - time.monotonic()
+            if len(cls.pending) < cls.flush_size and wait > 0:
+                try:
+                    await asyncio.wait_for(cls._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                cls._wake.clear()
+                continue
+
+            # Write, backing off if it fails
+            if cls.dropped:
+                cls.logger.warning(f"Dropped {cls.dropped} points past the pending limit")
+                cls.dropped = 0
+            try:
+                await cls.flush()
+            except Exception:
+                cls._failures += 1
+                if cls._failures >= cls.breaker_failures:
+                    delay = cls.breaker_cooldown
+                    cls.logger.exception(
+                        f"Failed to flush pending points {cls._failures} times in a row - "
+                        f"not retrying for {delay:.0f}s"
+                    )
+                else:
+                    delay = min(2 ** (cls._failures - 1), cls.max_retry_delay)
+                    cls.logger.exception(
+                        f"Failed to flush pending points - retrying in {delay:.0f}s"
+                    )
+                await asyncio.sleep(delay)
+            else:
+                cls._failures = 0
+
+    @classmethod
+    def circuit_open(cls) -> bool:
+        """
+        Whether flushing has failed enough times in a row that it's backed
+        off for the cooldown.
+        """
+
+        return cls._failures >= cls.breaker_failures
+
+    @classmethod
+    def oldest_timestamp(cls) -> Optional[dt]:
+        """
+        Get the timestamp of the oldest point that's pending or being
+        flushed, if there are any.
+        """
+
+        timestamps = [
+            min(buffer.timestamps)
+            for buffer in (cls.pending, cls._flushing)
+            if buffer
+        ]
+        if not timestamps:
+            return None
+        return _EPOCH + timedelta(microseconds=min(timestamps))
+
+    @classmethod
+    async def flush(cls) -> int:
+        """
+        Write every pending point, returning how many were written. If a
+        batch fails then it and everything after it are put back to be
+        retried on the next flush.
+        """
+
+        buffer = cls.pending
+        cls.logger.info(f"Storing {len(buffer)} pending points in database")
+        if not buffer:
+            return 0
+
+        # Swap buffers (and journal segments) so that points pushed mid-flush
+        # aren't touched
+        cls.pending = cls._spare if cls._spare is not None else PointBuffer()
+        cls._spare = None
+        cls._flushing = buffer
+        oldest = cls._oldest
+        sealed = await cls.journal.rotate() if cls.journal is not None else None
+        written = 0
+        try:
+            for index in range(0, len(buffer), cls.batch_size):
+                batch = buffer.records(index, index + cls.batch_size)
+                await cls.write_batch(batch)
+                written += len(batch)
+        finally:
+            # Put back anything that wasn't written, as long as there's room
+            if written < len(buffer):
+                room = max(cls.max_pending - len(cls.pending), 0)
+                if len(buffer) - written > room:
+                    cls.dropped += len(buffer) - written - room
+                    for name in PointBuffer.__slots__:
+                        del getattr(buffer, name)[written + room:]
+                cls.pending.extend(buffer, written)
+                cls._oldest = oldest
+
+            # Journal anything that's been put back into the new segment, so
+            # the sealed segments only ever hold points that are written
+            if cls.journal is not None and sealed is not None:
+                for point in buffer.records(written, len(buffer)):
+                    cls.journal.append(*point)
+                await cls.journal.commit()
+                cls.journal.remove_sealed(sealed)
+            cls._flushing = None
+            buffer.clear()
+            cls._spare = buffer
+        return written
+
+    @classmethod
+    async def write_batch(cls, records: list[PointRecord]) -> None:
+        """
+        Write a batch of points to user_points and the rollup tables in one
+        transaction, and then to the cache.
+        """
+
+        assert cls.database, "PointIngest hasn't been started"
+
+        # Write to the database and then the cache as one step, so that the
+        # cache reconciler and loaders never see one without the other
+        async with PointHolder.flushing():
+            async with cls.database() as db:
+                async with db.conn.transaction():
+                    await cls.write_records(db, records)
+
+            if cls.update_cache:
+                for timestamp, user_id, guild_id, _, source in records:
+                    PointHolder.add_point(user_id, guild_id, source, timestamp)
+
+    @classmethod
+    async def write_records(cls, db: vbu.Database, records: list[PointRecord]) -> None:
+        """
+        Write points straight to user_points and the rollup tables over the
+        given connection, without going through the pending buffer or the
+        cache. This should be run inside a transaction.
+        """
+
+        if cls.staging_copy:
+            await cls._write_staged(db, records)
+        else:
+            await cls._write_rows(db, records)
+
+    @classmethod
+    def _copy_records(cls, records: list[PointRecord], *, raw_only: bool = False) -> list[tuple]:
+        skip = PointSource.voice if raw_only and cls.voice_sessions else None
+        return [
+            (timestamp, user_id, guild_id, channel_id, source.name)
+            for timestamp, user_id, guild_id, channel_id, source in records
+            if source is not skip
+        ]
+
+    @classmethod
+    async def _write_rows(cls, db: vbu.Database, records: list[PointRecord]) -> None:
+        """
+        Copy the points into user_points, and upsert each of the rollups
+        after pre-aggregating them here.
+        """
+
+        counts: list[collections.Counter[tuple]] = [
+            collections.Counter()
+            for _ in _ROLLUPS
+        ]
+        for timestamp, user_id, guild_id, _, source in records:
+            for counter, (_, _, to_bucket, _) in zip(counts, _ROLLUPS):
+                counter[(guild_id, user_id, source.name, to_bucket(timestamp))] += 1
+
+        await db.conn.copy_records_to_table(
+            'user_points',
+            columns=_COPY_COLUMNS,
+            records=cls._copy_records(records, raw_only=True),
+        )
+        for counter, (table, column, _, _) in zip(counts, _ROLLUPS):
+            await db.conn.executemany(
+                f"""
+                INSERT INTO {table} (
+                    guild_id,
+                    user_id,
+                    source,
+                    {column},
+                    points
+                )
+                VALUES ($1, $2, $3::point_source, $4, $5)
+                ON CONFLICT (guild_id, user_id, {column}, source)
+                DO UPDATE SET points = {table}.points + EXCLUDED.points
+                """,
+                [
+                    (*key, points)
+                    for key, points in counter.items()
+                ],
+            )
+
+    @classmethod
+    async def _write_staged(cls, db: vbu.Database, records: list[PointRecord]) -> None:
+        """
+        Copy the points into a temporary staging table, and then move them
+        into user_points and aggregate them into each of the rollups
+        server-side, all in one round trip.
+        """
+
+        await db.conn.execute(
+            """
+            CREATE TEMPORARY TABLE IF NOT EXISTS point_ingest_staging (
+                timestamp TIMESTAMP NOT NULL,
+                user_id BIGINT NOT NULL,
+                guild_id BIGINT NOT NULL,
+                channel_id BIGINT,
+                source point_source NOT NULL
+            ) ON COMMIT DELETE ROWS
+            """
+        )
+        await db.conn.copy_records_to_table(
+            'point_ingest_staging',
+            columns=_COPY_COLUMNS,
+            records=cls._copy_records(records),
+        )
+        statements = [
+            f"""
+            INSERT INTO user_points ({", ".join(_COPY_COLUMNS)})
+            SELECT {", ".join(_COPY_COLUMNS)} FROM point_ingest_staging
+            {"WHERE source != 'voice'" if cls.voice_sessions else ""}
+            """
+        ]
+        for table, column, _, expression in _ROLLUPS:
+            statements.append(
+                f"""
+                INSERT INTO {table} (
+                    guild_id,
+                    user_id,
+                    source,
+                    {column},
+                    points
+                )
+                SELECT
+                    guild_id,
+                    user_id,
+                    source,
+                    {expression},
+                    COUNT(*)
+                FROM
+                    point_ingest_staging
+                GROUP BY
+                    guild_id,
+                    user_id,
+                    source,
+                    {expression}
+                ON CONFLICT (guild_id, user_id, {column}, source)
+                DO UPDATE SET points = {table}.points + EXCLUDED.points
+                """
+            )
+        await db.conn.execute(";".join(statements))
@@ -0,0 +1,221 @@
+"""
+A local write-ahead journal for points that haven't been written to the
+database yet, so that they survive the process dying between flushes.
+
+The journal is a directory of numbered segment files. Points are appended to
+the newest segment, and are committed (written and fsynced) in groups. When the
+ingest pipeline flushes it seals the current segment and starts a new one,
+and once the flush succeeds every sealed segment is deleted. Whatever segments
+are left on startup are replayed.
+
+Segment format, all values little-endian:
+
+    frame (repeated):
+        length          uint32      number of bytes in the payload
+        checksum        uint32      CRC-32 of the payload
+        payload         length bytes, made up of point records
+
+    point record:
+        timestamp       int64       microseconds since the epoch (UTC)
+        user_id         int64
+        guild_id        int64
+        channel_id      int64       0 for no channel
+        source          uint8       index into PointSource
+
+A frame that's cut short or fails its checksum marks the end of a segment -
+it can only be a group that was never committed.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime as dt, timedelta
+import logging
+import os
+import struct
+from typing import BinaryIO, ClassVar, Optional
+import zlib
+
+from .cache_tools import _EPOCH, _MICROSECOND, _SOURCE_INDEX, _SOURCES, PointSource
+
+
+__all__ = (
+    "PointJournal",
+)
+
+
+FRAME_HEADER = struct.Struct("<II")
+RECORD = struct.Struct("<qqqqB")
+SEGMENT_SUFFIX = ".journal"
+
+
+class PointJournal:
+    """
+    An append-only journal of pending points, split into segments.
+    """
+
+    # How often appended points are committed to disk
+    commit_interval: ClassVar[float] = 0.1
+
+    logger: ClassVar[logging.Logger] = logging.getLogger(__name__)
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.sealed: list[int] = self._segment_numbers()
+        self.segment = (self.sealed[-1] if self.sealed else 0) + 1
+        self.file: BinaryIO = open(self._segment_path(self.segment), "ab", buffering=0)
+        self.group = bytearray()
+        self._commit_task: Optional[asyncio.Task] = None
+
+        # Held while a segment is being fsynced, so that a rotation can't
+        # close it out from under a commit
+        self._sync_lock = asyncio.Lock()
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:010d}{SEGMENT_SUFFIX}")
+
+    def _segment_numbers(self) -> list[int]:
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def append(
+            self,
+            timestamp: dt,
+            user_id: int,
+            guild_id: int,
+            channel_id: Optional[int],
+            source: PointSource) -> None:
+        """
+        Add a point to the group waiting to be committed.
+        """
+
+        self.group += RECORD.pack(
+            (timestamp - _EPOCH) // _MICROSECOND,
+            user_id,
+            guild_id,
+            channel_id or 0,
+            _SOURCE_INDEX[source],
+        )
+
+    def _write_group(self) -> None:
+        if not self.group:
+            return
+        payload = bytes(self.group)
+        self.group.clear()
+        self.file.write(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self.file.write(payload)
+
+    async def commit(self) -> None:
+        """
+        Write the waiting group of points to the current segment and fsync
+        it.
+        """
+
+        async with self._sync_lock:
+            if not self.group:
+                return
+            file = self.file
+            self._write_group()
+            await asyncio.get_running_loop().run_in_executor(None, os.fsync, file.fileno())
+
+    async def _commit_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.commit_interval)
+            try:
+                await self.commit()
+            except Exception as e:
+                self.logger.error("Failed to commit point journal", exc_info=e)
+
+    def start(self) -> None:
+        """
+        Start committing appended points in the background.
+        """
+
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.create_task(self._commit_loop())
+
+    async def close(self) -> None:
+        """
+        Stop committing in the background, committing anything that's
+        waiting, and close the current segment.
+        """
+
+        if self._commit_task is not None:
+            self._commit_task.cancel()
+            self._commit_task = None
+        await self.commit()
+        async with self._sync_lock:
+            self.file.close()
+
+    async def rotate(self) -> int:
+        """
+        Seal the current segment and start a new one, returning the number of
+        the sealed segment. Everything appended before this is called is in
+        the sealed segment, which is fsynced and closed once any commit in
+        progress is done with it.
+        """
+
+        # Switch segments before anything is awaited, so that no points
+        # appended after this call end up in the sealed segment
+        self._write_group()
+        sealed_file = self.file
+        self.sealed.append(self.segment)
+        sealed = self.segment
+        self.segment += 1
+        self.file = open(self._segment_path(self.segment), "ab", buffering=0)
+
+        def sync_and_close():
+            try:
+                os.fsync(sealed_file.fileno())
+            finally:
+                sealed_file.close()
+        async with self._sync_lock:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, sync_and_close)
+            except OSError as e:
+                self.logger.error(f"Failed to sync sealed journal segment {sealed}", exc_info=e)
+        return sealed
+
+    def remove_sealed(self, up_to: int) -> None:
+        """
+        Delete every sealed segment up to and including the given number,
+        once their points are safely in the database.
+        """
+
+        for number in [i for i in self.sealed if i <= up_to]:
+            try:
+                os.remove(self._segment_path(number))
+            except FileNotFoundError:
+                pass
+            self.sealed.remove(number)
+
+    def replay(self) -> list[tuple[dt, int, int, Optional[int], PointSource]]:
+        """
+        Read back the points in every sealed segment.
+        """
+
+        points = []
+        for number in self.sealed:
+            with open(self._segment_path(number), "rb") as a:
+                data = a.read()
+            offset = 0
+            while offset + FRAME_HEADER.size <= len(data):
+                length, checksum = FRAME_HEADER.unpack_from(data, offset)
+                offset += FRAME_HEADER.size
+                payload = data[offset:offset + length]
+                if len(payload) != length or zlib.crc32(payload) != checksum:
+                    break
+                offset += length
+                for timestamp, user_id, guild_id, channel_id, source in RECORD.iter_unpack(payload):
+                    points.append((
+                        _EPOCH + timedelta(microseconds=timestamp),
+                        user_id,
+                        guild_id,
+                        channel_id or None,
+                        _SOURCES[source],
+                    ))
+        return points
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from typing import Generic, Iterable, Optional, TypeVar
+
+
+__all__ = (
+    "MemberCache",
+)
+
+
+M = TypeVar("M")
+
+
+class MemberCache(Generic[M]):
+    """
+    A cache of member lookups for members that aren't in the gateway cache.
+
+    Members that were found are kept for the positive TTL, and members that
+    weren't (they've left the guild, say) are kept for the negative TTL, so
+    that the same user IDs aren't queried for every minute.
+    """
+
+    __slots__ = ("ttl", "negative_ttl", "found", "missing")
+
+    def __init__(self, ttl: float = 300.0, negative_ttl: float = 300.0):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # {(guild_id, user_id): (member, expiry)}
+        self.found: dict[tuple[int, int], tuple[M, float]] = {}
+        # {(guild_id, user_id): expiry}
+        self.missing: dict[tuple[int, int], float] = {}
+
+    def __len__(self) -> int:
+        return len(self.found) + len(self.missing)
+
+    def get(self, guild_id: int, user_id: int, now: float) -> Optional[M]:
+        """
+        Get a member that was found, if it hasn't expired.
+        """
+
+        cached = self.found.get((guild_id, user_id))
+        if cached is None or cached[1] <= now:
+            return None
+        return cached[0]
+
+    def unknown(self, guild_id: int, user_ids: Iterable[int], now: float) -> set[int]:
+        """
+        Get which of the given user IDs have no unexpired entry, found or
+        missing, and so need to be looked up.
+        """
+
+        unknown = set()
+        for user_id in user_ids:
+            key = (guild_id, user_id)
+            cached = self.found.get(key)
+            if cached is not None and cached[1] > now:
+                continue
+            expiry = self.missing.get(key)
+            if expiry is not None and expiry > now:
+                continue
+            unknown.add(user_id)
+        return unknown
+
+    def add_found(self, guild_id: int, user_id: int, member: M, now: float) -> None:
+        self.missing.pop((guild_id, user_id), None)
+        self.found[(guild_id, user_id)] = (member, now + self.ttl)
+
+    def add_missing(self, guild_id: int, user_ids: Iterable[int], now: float) -> None:
+        expiry = now + self.negative_ttl
+        for user_id in user_ids:
+            self.found.pop((guild_id, user_id), None)
+            self.missing[(guild_id, user_id)] = expiry
+
+    def expire(self, now: float) -> None:
+        """
+        Drop every entry that has expired.
+        """
+
+        self.found = {
+            key: cached
+            for key, cached in self.found.items()
+            if cached[1] > now
+        }
+        self.missing = {
+            key: expiry
+            for key, expiry in self.missing.items()
+            if expiry > now
+        }
@@ -0,0 +1,204 @@
+"""
+Snapshots of the PointHolder buckets, so that a restart can skip reloading
+the whole rollup history from the database.
+
+File format (version 1), all values little-endian:
+
+    header:
+        magic           4 bytes     b"CRBS"
+        version         uint16      1
+        source_count    uint16      number of point source columns
+        watermark       int64       unix time (UTC) that every point before
+                                    was in the cache when the snapshot was taken
+        series_count    uint32      number of series records that follow
+
+    series record (repeated series_count times):
+        tier            uint8       0 = hour, 1 = day, 2 = month
+        guild_id        int64
+        user_id         int64
+        length          uint32      number of buckets in the series
+        keys            int32 * length
+                        bucket offsets from the epoch - hours, days or months
+                        (year * 12 + month - 1) depending on the tier
+        columns         float64 * length * source_count
+                        one column per point source in PointSource order,
+                        each holding the running total up to each bucket
+
+Every bucket at or after the watermark's hour/day/month may have changed in
+the database after the snapshot was taken, so those should be re-read from
+the rollup tables with PointHolder.set_bucket after loading.
+"""
+
+from __future__ import annotations
+
+from array import array
+import asyncio
+from datetime import datetime as dt, timezone
+import mmap
+import os
+import struct
+import sys
+from typing import Callable, NamedTuple, Optional
+
+from .cache_tools import PointHolder, PointSeries, PointSource
+
+
+__all__ = (
+    "Snapshot",
+    "write_snapshot",
+    "load_snapshot",
+)
+
+
+MAGIC = b"CRBS"
+VERSION = 1
+HEADER = struct.Struct("<4sHHqI")
+SERIES_HEADER = struct.Struct("<BqqI")
+TIERS = ("hour", "day", "month")
+
+_SWAP = sys.byteorder != "little"
+
+
+class Snapshot(NamedTuple):
+    watermark: dt
+    guild_ids: set[int]
+
+
+def _to_bytes(data: array) -> bytes:
+    if _SWAP:
+        data = array(data.typecode, data)
+        data.byteswap()
+    return data.tobytes()
+
+
+def _from_bytes(typecode: str, data: memoryview) -> array:
+    output = array(typecode)
+    output.frombytes(data)
+    if _SWAP:
+        output.byteswap()
+    return output
+
+
+async def write_snapshot(path: str, watermark: Optional[dt] = None) -> dt:
+    """
+    Write every cached bucket to the given path, replacing the file
+    atomically. Returns the watermark that was written.
+
+    The watermark must be no later than the timestamp of any point that
+    isn't in the cache yet, or that point won't be re-read after loading.
+    It defaults to now.
+
+    Guilds that aren't fully loaded yet (their lazy load is still running,
+    or failed) are left out, so they're loaded from scratch after restarting.
+    """
+
+    watermark = watermark or dt.utcnow()
+    chunks: list[bytes] = []
+    series_count = 0
+
+    # Serialise on the event loop so nothing changes under us mid-series
+    for tier_index, tier in enumerate(TIERS):
+        storage = PointHolder._tier_storage(tier)
+        for guild_index, guild_id in enumerate(list(storage)):
+            if guild_index % 100 == 0:
+                await asyncio.sleep(0)
+            if not PointHolder.is_guild_loaded(guild_id):
+                continue
+            for user_id, series in storage.get(guild_id, {}).items():
+                chunks.append(SERIES_HEADER.pack(
+                    tier_index,
+                    guild_id,
+                    user_id,
+                    len(series),
+                ))
+                chunks.append(_to_bytes(series.keys))
+                for column, base in zip(series.columns, series.bases):
+                    if base:
+                        column = array("d", (i - base for i in column))
+                    chunks.append(_to_bytes(column))
+                series_count += 1
+
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        len(PointSource),
+        int(watermark.replace(tzinfo=timezone.utc).timestamp()),
+        series_count,
+    )
+
+    # And write to disk off of the event loop
+    def write():
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as a:
+            a.write(header)
+            a.writelines(chunks)
+            a.flush()
+            os.fsync(a.fileno())
+        os.replace(temp_path, path)
+    await asyncio.get_running_loop().run_in_executor(None, write)
+    return watermark
+
+
+def load_snapshot(
+        path: str,
+        *,
+        guild_filter: Optional[Callable[[int], bool]] = None) -> Optional[Snapshot]:
+    """
+    Load a snapshot from the given path into the PointHolder, replacing any
+    series that it contains. If a guild filter is given then only series for
+    guilds that it accepts are loaded. Returns the snapshot's watermark and
+    the IDs of the guilds that were loaded from it, or None if there is no
+    usable snapshot at that path.
+    """
+
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    if os.fstat(file.fileno()).st_size < HEADER.size:
+        file.close()
+        return None
+    with file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            magic, version, source_count, watermark, series_count = (
+                HEADER.unpack_from(view)
+            )
+            if magic != MAGIC or version != VERSION or source_count != len(PointSource):
+                return None
+
+            # Parse everything before touching the cache, so a truncated file
+            # doesn't leave a partial load behind
+            loaded: list[tuple[int, int, PointSeries, str]] = []
+            offset = HEADER.size
+            for _ in range(series_count):
+                if offset + SERIES_HEADER.size > len(view):
+                    return None
+                tier_index, guild_id, user_id, length = (
+                    SERIES_HEADER.unpack_from(view, offset)
+                )
+                offset += SERIES_HEADER.size
+                record_size = length * (4 + source_count * 8)
+                if offset + record_size > len(view):
+                    return None
+                if guild_filter is not None and not guild_filter(guild_id):
+                    offset += record_size
+                    continue
+                series = PointSeries()
+                series.keys = _from_bytes("i", view[offset:offset + length * 4])
+                offset += length * 4
+                series.columns = tuple(
+                    _from_bytes("d", view[offset + (i * length * 8):offset + ((i + 1) * length * 8)])
+                    for i in range(source_count)
+                )
+                offset += source_count * length * 8
+                loaded.append((user_id, guild_id, series, TIERS[tier_index]))
+
+    for user_id, guild_id, series, tier in loaded:
+        PointHolder.load_series(user_id, guild_id, series, bucket=tier)
+    return Snapshot(
+        dt.fromtimestamp(watermark, timezone.utc).replace(tzinfo=None),
+        {i[1] for i in loaded},
+    )
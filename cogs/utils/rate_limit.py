@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from typing import Generic, Hashable, TypeVar
+
+
+__all__ = (
+    "RateLimiter",
+)
+
+
+K = TypeVar("K", bound=Hashable)
+
+
+class RateLimiter(Generic[K]):
+    """
+    Lets each key through at most once per window.
+
+    The time each key was last let through is kept across two generations of
+    dicts. Once a window has passed the current generation becomes the
+    previous one and the old previous one is thrown away whole, so only keys
+    seen in roughly the last two windows are ever held, and every lookup is
+    at most two dict reads.
+    """
+
+    __slots__ = ("window", "current", "previous", "rotated_at")
+
+    def __init__(self, window: float):
+        self.window = window
+        self.current: dict[K, float] = {}
+        self.previous: dict[K, float] = {}
+        self.rotated_at = float("-inf")
+
+    def __len__(self) -> int:
+        return len(self.current) + len(self.previous)
+
+    def _rotate(self, now: float) -> None:
+        since = now - self.rotated_at
+        if since < self.window:
+            return
+        self.previous = self.current if since < self.window * 2 else {}
+        self.current = {}
+        self.rotated_at = now
+
+    def hit(self, key: K, now: float) -> bool:
+        """
+        Check if a key can be let through at the given time (in seconds),
+        recording it if so.
+        """
+
+        self._rotate(now)
+        last = self.current.get(key)
+        if last is None:
+            last = self.previous.get(key)
+        if last is not None and now - last < self.window:
+            return False
+        self.current[key] = now
+        return True
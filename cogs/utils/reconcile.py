@@ -0,0 +1,136 @@
+"""
+Checksums for comparing cached PointSeries against the rollup tables.
+
+Each (guild, user) series is summarised over a range of bucket keys as the
+number of non-zero (bucket, source) cells, the total of those cells, and a
+total where each cell is weighted by its bucket key and source. The same
+summary is calculated server-side with GROUP BY, so a guild can be checked in
+a single query and only the series that differ need to be read back in full.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import NamedTuple
+
+from .bulk_load import KEY_EXPRESSIONS
+from .cache_tools import PointSeries, PointSource
+
+
+__all__ = (
+    "Checksum",
+    "series_checksum",
+    "build_checksum_query",
+    "build_cells_query",
+)
+
+
+CHECKSUM_MODULUS = 65521
+
+
+class Checksum(NamedTuple):
+    cells: int
+    points: float
+    weighted_points: float
+
+    def matches(self, other: Checksum) -> bool:
+        return (
+            self.cells == other.cells
+            and math.isclose(self.points, other.points, abs_tol=1e-6)
+            and math.isclose(self.weighted_points, other.weighted_points, abs_tol=1e-6)
+        )
+
+
+EMPTY_CHECKSUM = Checksum(0, 0.0, 0.0)
+
+
+def series_checksum(series: PointSeries, start_key: int) -> Checksum:
+    """
+    Get the checksum of the buckets in a series from the given key onwards.
+    """
+
+    source_count = len(PointSource)
+    cells = 0
+    points = 0.0
+    weighted_points = 0.0
+    keys = series.keys
+    for index in range(len(keys) - 1, -1, -1):
+        key = keys[index]
+        if key < start_key:
+            break
+        for source_index in range(source_count):
+            value = series.value(index, source_index)
+            if value:
+                cells += 1
+                points += value
+                weighted_points += value * ((key * source_count + source_index) % CHECKSUM_MODULUS)
+    return Checksum(cells, points, weighted_points)
+
+
+def _source_index_expression() -> str:
+    cases = " ".join(
+        f"WHEN '{source.name}' THEN {index}"
+        for index, source in enumerate(PointSource)
+    )
+    return f"(CASE source {cases} END)"
+
+
+def build_checksum_query(bucket: str, table: str, column: str) -> str:
+    """
+    Build a query that outputs the checksum of every series in a rollup table
+    as (guild_id, user_id, cells, points, weighted_points), for the guilds in
+    the array $1 and from the bucket key $2 onwards.
+    """
+
+    key = KEY_EXPRESSIONS[bucket].format(column=column)
+    return f"""
+        SELECT
+            guild_id,
+            user_id,
+            COUNT(*) AS cells,
+            SUM(points) AS points,
+            SUM(
+                points * MOD(
+                    {key}::BIGINT * {len(PointSource)} + {_source_index_expression()},
+                    {CHECKSUM_MODULUS}
+                )
+            ) AS weighted_points
+        FROM
+            {table}
+        WHERE
+            guild_id = ANY($1::BIGINT[])
+        AND
+            {key} >= $2
+        AND
+            points != 0
+        GROUP BY
+            guild_id,
+            user_id
+    """
+
+
+def build_cells_query(bucket: str, table: str, column: str) -> str:
+    """
+    Build a query that outputs the cells of the series for the (guild, user)
+    pairs in the arrays $1 and $2, from the bucket key $3 onwards.
+    """
+
+    key = KEY_EXPRESSIONS[bucket].format(column=column)
+    return f"""
+        SELECT
+            guild_id,
+            user_id,
+            {column} AS bucket,
+            source,
+            points
+        FROM
+            {table}
+        WHERE
+            (guild_id, user_id) IN (
+                SELECT * FROM UNNEST($1::BIGINT[], $2::BIGINT[])
+            )
+        AND
+            {key} >= $3
+        AND
+            points != 0
+    """
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime as dt, timedelta
+from typing import Iterable, Iterator, Optional
+import zlib
+
+
+__all__ = (
+    "VoiceTracker",
+    "VoiceSession",
+    "VoiceSessionLog",
+    "ScanPacer",
+)
+
+
+class VoiceTracker:
+    """
+    An index of who is in each voice channel, kept up to date from voice
+    state updates.
+
+    For each channel this keeps the (non-bot) members in it, and which of
+    them are eligible for points - not muted, deafened or AFK. Channels where
+    someone is eligible and isn't alone are kept in a separate set, so that
+    handing out points only touches channels that will actually get any.
+    """
+
+    def __init__(self):
+        # {channel_id: {user_id}}
+        self.members: dict[int, set[int]] = {}
+        # {channel_id: {user_id}}
+        self.eligible: dict[int, set[int]] = {}
+        # {channel_id: guild_id}
+        self.channel_guilds: dict[int, int] = {}
+        # {(guild_id, user_id): channel_id}
+        self.locations: dict[tuple[int, int], int] = {}
+        # {channel_id}
+        self.active: set[int] = set()
+
+    def _refresh(self, channel_id: int) -> None:
+        members = self.members.get(channel_id)
+        if not members:
+            self.members.pop(channel_id, None)
+            self.eligible.pop(channel_id, None)
+            self.channel_guilds.pop(channel_id, None)
+            self.active.discard(channel_id)
+        elif len(members) > 1 and self.eligible.get(channel_id):
+            self.active.add(channel_id)
+        else:
+            self.active.discard(channel_id)
+
+    def set_state(
+            self,
+            guild_id: int,
+            user_id: int,
+            channel_id: Optional[int],
+            eligible: bool = False) -> None:
+        """
+        Set which channel a user is in (or None if they've left voice), and
+        whether or not they're eligible for points.
+        """
+
+        # Take them out of wherever they were
+        previous = self.locations.pop((guild_id, user_id), None)
+        if previous is not None:
+            self.members[previous].discard(user_id)
+            self.eligible[previous].discard(user_id)
+            if previous != channel_id:
+                self._refresh(previous)
+
+        # And put them wherever they are now
+        if channel_id is None:
+            return
+        self.locations[(guild_id, user_id)] = channel_id
+        self.channel_guilds[channel_id] = guild_id
+        self.members.setdefault(channel_id, set()).add(user_id)
+        eligible_members = self.eligible.setdefault(channel_id, set())
+        if eligible:
+            eligible_members.add(user_id)
+        self._refresh(channel_id)
+
+    def remove_channel(self, channel_id: int) -> None:
+        """
+        Forget everyone in a channel.
+        """
+
+        guild_id = self.channel_guilds.get(channel_id)
+        for user_id in list(self.members.get(channel_id, ())):
+            self.set_state(guild_id, user_id, None)  # type: ignore
+
+    def remove_guild(self, guild_id: int) -> None:
+        """
+        Forget everyone in a guild's channels.
+        """
+
+        for channel_id, channel_guild_id in list(self.channel_guilds.items()):
+            if channel_guild_id == guild_id:
+                self.remove_channel(channel_id)
+
+    def eligible_members(self) -> Iterator[tuple[int, int, int]]:
+        """
+        Get every user eligible for points right now, as
+        (user_id, guild_id, channel_id).
+        """
+
+        for channel_id in self.active:
+            guild_id = self.channel_guilds[channel_id]
+            for user_id in self.eligible[channel_id]:
+                yield user_id, guild_id, channel_id
+
+
+@dataclass(slots=True)
+class VoiceSession:
+    """
+    A run of consecutive eligible minutes for a user in a single voice
+    channel.
+    """
+
+    guild_id: int
+    user_id: int
+    channel_id: int
+    start: dt
+    end: dt
+    minutes: int = 1
+
+    # How many minutes the session had when it was last saved
+    saved_minutes: int = 0
+
+    def as_row(self) -> tuple[int, int, int, dt, dt, int]:
+        return (
+            self.guild_id,
+            self.user_id,
+            self.channel_id,
+            self.start,
+            self.end,
+            self.minutes,
+        )
+
+
+class VoiceSessionLog:
+    """
+    Turns each minute's eligible voice members into sessions - opening a
+    session on someone's first eligible minute in a channel, extending it
+    for every minute after, and closing it on the first minute they aren't
+    eligible or have moved.
+    """
+
+    def __init__(self, gap: timedelta = timedelta(minutes=2)):
+        # The longest time between minutes for them to count as consecutive
+        self.gap = gap
+        # {(guild_id, user_id): session}
+        self.open: dict[tuple[int, int], VoiceSession] = {}
+
+    def tick(
+            self,
+            now: dt,
+            members: Iterable[tuple[int, int, int]]) -> list[VoiceSession]:
+        """
+        Add a minute for each of the given (user_id, guild_id, channel_id)
+        members. Returns the sessions that were closed.
+        """
+
+        closed: list[VoiceSession] = []
+        seen: set[tuple[int, int]] = set()
+        for user_id, guild_id, channel_id in members:
+            key = (guild_id, user_id)
+            seen.add(key)
+            session = self.open.get(key)
+            if session is not None:
+                if session.channel_id == channel_id and now - session.end <= self.gap:
+                    session.end = now
+                    session.minutes += 1
+                    continue
+                closed.append(session)
+            self.open[key] = VoiceSession(guild_id, user_id, channel_id, now, now)
+        for key in [i for i in self.open if i not in seen]:
+            closed.append(self.open.pop(key))
+        return closed
+
+    def unsaved(self) -> list[VoiceSession]:
+        """
+        Get the open sessions that have changed since they were last saved.
+        """
+
+        return [
+            session
+            for session in self.open.values()
+            if session.minutes != session.saved_minutes
+        ]
+
+    def close_all(self) -> list[VoiceSession]:
+        """
+        Close every open session, returning them.
+        """
+
+        closed = list(self.open.values())
+        self.open.clear()
+        return closed
+
+
+class ScanPacer:
+    """
+    Spreads the per-minute voice scan across the minute.
+
+    Each guild is given a fixed phase slot within the spread, so that its
+    minutes are always the same distance apart, and guilds are handled in
+    slices as their slots come round. The slice size shrinks when the event
+    loop is lagging and grows back when it isn't.
+    """
+
+    slots: int = 60
+
+    def __init__(
+            self,
+            spread: float = 50.0,
+            slice_size: int = 50,
+            min_slice_size: int = 5,
+            max_slice_size: int = 500,
+            target_lag: float = 0.05):
+        self.spread = spread
+        self.slice_size = slice_size
+        self.min_slice_size = min_slice_size
+        self.max_slice_size = max_slice_size
+        self.target_lag = target_lag
+
+    def phase(self, guild_id: int) -> int:
+        """
+        Get which slot in the minute a guild is scanned in. This is a hash of
+        the whole ID, as the shard a guild is on comes from its timestamp bits
+        and every guild on a process would otherwise share a few slots.
+        """
+
+        return zlib.crc32(guild_id.to_bytes(8, "little")) % self.slots
+
+    def due_at(self, guild_id: int) -> float:
+        """
+        Get how many seconds into the scan a guild is due.
+        """
+
+        return self.phase(guild_id) * self.spread / self.slots
+
+    def take(self, ordered: list[int], start: int, elapsed: float) -> int:
+        """
+        Given guild IDs in phase order, get the end of the slice starting at
+        the given index - only guilds that are due by the elapsed time, and
+        no more than the slice size.
+        """
+
+        end = start
+        limit = min(len(ordered), start + self.slice_size)
+        while end < limit and self.due_at(ordered[end]) <= elapsed:
+            end += 1
+        return end
+
+    def record_lag(self, lag: float) -> None:
+        """
+        Adjust the slice size from how late the event loop got back to us.
+        """
+
+        if lag > self.target_lag:
+            self.slice_size = max(self.min_slice_size, self.slice_size // 2)
+        elif lag < self.target_lag / 2:
+            self.slice_size = min(self.max_slice_size, self.slice_size + self.min_slice_size)
@@ -10,6 +10,8 @@ from aiohttp.web import (
 import aiohttp_session
 from discord.ext import vbu
 
+from cogs import utils
+
 
 routes = RouteTableDef()
 
@@ -144,17 +146,23 @@ async def minecraft_server_activity(request: Request):
                 },
                 status=401,
             )
+
+        # Store the points straight away - there's only a handful per request,
+        # and the website doesn't have a point cache to update
         now = dt.utcnow()
-        for uid in player_ids:
-            await db(
-                """
-                INSERT INTO
-                    user_points
-                    (user_id, guild_id, timestamp, source)
-                VALUES
-                    ($1, $2, $3, 'minecraft')
-                """,
-                uid, guild_id, now,
+        async with db.conn.transaction():
+            await utils.ingest.PointIngest.write_records(
+                db,
+                [
+                    utils.ingest.PointRecord(
+                        now,
+                        uid,
+                        guild_id,
+                        None,
+                        utils.cache.PointSource.minecraft,
+                    )
+                    for uid in player_ids
+                ],
             )
     return json_response(
         {